@@ -34,5 +34,15 @@ write_field_frequency_iter = None
 # thời điểm hiển thị các thông số cơ bản của một bước
 print_frequency_iter = 100
 
-# lựa chọn hàm tính flux
-flux_func = flux_roe_fortran
\ No newline at end of file
+# số luồng (thread) tính song song, lưới 1 block: chia các hàng ô lưới cho các luồng
+num_threads = 1
+# num_threads = 4
+
+# lựa chọn hàm tính flux: hàm (ví dụ flux_roe_fortran), tên trong lib.fluxes.flux_registry
+# hoặc 'auto' - tự chọn hàm nhanh nhất trên lưới đang tính (phụ thuộc máy tính)
+flux_func = flux_roe_fortran
+# flux_func = 'auto'
+
+# chỉ tính trong các tile còn thay đổi, ví dụ vùng dòng tự do phía trước sóng va (không bắt buộc, xem lib.solver)
+# activity_tol = 1e-4
+# activity_tile = 16
@@ -34,5 +34,11 @@ write_field_frequency_iter = None
 # thời điểm hiển thị các thông số cơ bản của một bước
 print_frequency_iter = 1000
 
-# lựa chọn hàm tính flux
-flux_func = flux_roe_fortran
\ No newline at end of file
+# lựa chọn hàm tính flux: hàm (ví dụ flux_roe_fortran), tên trong lib.fluxes.flux_registry
+# hoặc 'auto' - tự chọn hàm nhanh nhất trên lưới đang tính (phụ thuộc máy tính)
+flux_func = flux_roe_fortran
+# flux_func = 'auto'
+
+# lịch sử hội tụ (file residual.dat) và dừng tính khi chuẩn L2 của res giảm 6 bậc (không bắt buộc)
+# residual_frequency_iter = 10
+# convergence_orders = 6
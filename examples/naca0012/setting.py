@@ -34,5 +34,21 @@ write_field_frequency_iter = None
 # thời điểm hiển thị các thông số cơ bản của một bước
 print_frequency_iter = 10
 
-# lựa chọn hàm tính flux
-flux_func = flux_roe
\ No newline at end of file
+# lựa chọn hàm tính flux: hàm (ví dụ flux_roe_fortran), tên trong lib.fluxes.flux_registry
+# hoặc 'auto' - tự chọn hàm nhanh nhất trên lưới đang tính (phụ thuộc máy tính)
+flux_func = flux_roe_fortran
+# flux_func = 'auto'
+
+# bước thời gian cục bộ (bài toán dừng): mỗi ô lưới được cập nhật với bước thời gian của nó (không bắt buộc)
+# local_time_step = True
+
+# phương pháp ẩn LU-SGS (bài toán dừng): CFL có thể lớn, ví dụ 100.0
+# time_scheme = 'lusgs'
+
+# multigrid (lib.multigrid): số lưới và chu trình 'V' hoặc 'W', dùng với time_scheme = 'jameson5', CFL = 2.5
+# multigrid_levels = 2
+# multigrid_cycle = 'V'
+
+# lịch sử hội tụ (file residual.dat) và dừng tính khi chuẩn L2 của res giảm 6 bậc (không bắt buộc)
+# residual_frequency_iter = 10
+# convergence_orders = 6
@@ -48,5 +48,30 @@ write_field_frequency_iter = 5000
 # thời điểm hiển thị các thông số cơ bản của một bước
 print_frequency_iter = 500
 
-# lựa chọn hàm tính flux, hàm flux_roe_fortran đã được include trong lib.boco
-flux_func = flux_roe_fortran
\ No newline at end of file
+# lựa chọn hàm tính flux, hàm flux_roe_fortran đã được include trong lib.boco: hàm (ví dụ flux_roe_fortran), tên trong lib.fluxes.flux_registry
+# hoặc 'auto' - tự chọn hàm nhanh nhất trên lưới đang tính (phụ thuộc máy tính)
+flux_func = flux_roe_fortran
+# flux_func = 'auto'
+
+# bước thời gian cục bộ (bài toán dừng): mỗi ô lưới được cập nhật với bước thời gian của nó (không bắt buộc)
+# local_time_step = True
+
+# phương pháp tích phân theo thời gian (lib.solver.rk_schemes), mặc định 'euler';
+# 'jameson4', 'jameson5' cho phép CFL khoảng 2.0, 2.5; 'ssp_rk3' cho bài toán không dừng;
+# 'lusgs' - phương pháp ẩn LU-SGS (bài toán dừng), CFL có thể lớn, ví dụ 100.0
+# time_scheme = 'jameson5'
+
+# hệ số làm trơn ẩn res (không bắt buộc), dùng với các phương pháp nhiều bước, ví dụ 'jameson5' với CFL = 5.0
+# residual_smoothing = 1.0
+
+# số CFL thay đổi theo res (SER, không bắt buộc): CFL tăng từ CFL tới CFL_max khi res giảm
+# CFL_max = 5.0
+
+# kiểm tra rho > 0, p > 0 sau mỗi bước lặp, quay lại trường đã lưu với CFL nhỏ hơn (mặc định bật, không bắt buộc)
+# divergence_check = True
+# snapshot_frequency_iter = 100
+# max_rollbacks = 5
+
+# lịch sử hội tụ (file residual.dat) và dừng tính khi chuẩn L2 của res giảm 6 bậc (không bắt buộc)
+# residual_frequency_iter = 10
+# convergence_orders = 6
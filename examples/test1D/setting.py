@@ -35,5 +35,7 @@ write_field_frequency_iter = None
 # thời điểm hiển thị các thông số cơ bản của một bước
 print_frequency_iter = 100
 
-# lựa chọn hàm tính flux
-flux_func = flux_roe_fortran
\ No newline at end of file
+# lựa chọn hàm tính flux: hàm (ví dụ flux_roe_fortran), tên trong lib.fluxes.flux_registry
+# hoặc 'auto' - tự chọn hàm nhanh nhất trên lưới đang tính (phụ thuộc máy tính)
+flux_func = flux_roe_fortran
+# flux_func = 'auto'
\ No newline at end of file
@@ -26,6 +26,7 @@ def boco_2blk():
 
     #[left block, left bound, id_start, id_end,
     # right block, right bound, id_start, id_end]
+    # hoặc joint_list = 'auto' - tìm các joint theo tọa độ điểm lưới (Blocks.find_joints)
     joint_list = [(0, 1, None, None, 1, 0, None, None)]
     boco_list = [blk1_bc_list, blk2_bc_list]
     return boco_list, joint_list
@@ -45,5 +46,15 @@ write_field_frequency_iter = None
 # thời điểm hiển thị các thông số cơ bản của một bước
 print_frequency_iter = 1000
 
-# lựa chọn hàm tính flux
-flux_func = flux_roe_fortran
\ No newline at end of file
+# số luồng (thread) tính song song, mỗi luồng tính một block
+num_threads = 1
+# num_threads = 2
+
+# lựa chọn hàm tính flux: hàm (ví dụ flux_roe_fortran), tên trong lib.fluxes.flux_registry
+# hoặc 'auto' - tự chọn hàm nhanh nhất trên lưới đang tính (phụ thuộc máy tính)
+flux_func = flux_roe_fortran
+# flux_func = 'auto'
+
+# chỉ tính trong các tile còn thay đổi, ví dụ vùng dòng tự do phía trước sóng va (không bắt buộc, xem lib.solver)
+# activity_tol = 1e-4
+# activity_tile = 16
@@ -1,6 +1,7 @@
 # coding: utf-8
 # Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
 
+from numpy import asarray, empty, where, sum as np_sum
 from .constants import gamma, gamma_m1
 from .functions import Mach, VSound, P2F
 from .fluxes import flux_roe_fortran
@@ -112,10 +113,87 @@ def inflow(boundary, ic):
         else: F = flux_roe_fortran(side, P_in, P_b)
         side.cells[ic].res += sign_ic(ic)*F
 
-# Điều kiện biên joint
+# Điều kiện biên joint: ô lưới ảo chứa P của ô lưới bên kia biên (halo của block kề)
 def joint(boundary, ic):
-    pass
+    for side in boundary:
+        F = flux_roe_fortran(side, side.cells[0].P, side.cells[1].P)
+        side.cells[ic].res += sign_ic(ic) * F
 
 # Điều kiện biên null
 def null(boundary, ic):
     pass
+
+
+'''
+    Điều kiện biên dạng mảng: mỗi hàm tính trạng thái P_out bên ngoài của cả một đoạn biên.
+    :param P_in:    mảng (N, 4) biến nguyên thủy của các ô lưới sát biên
+    :param normals: mảng (N, 2) vector pháp tuyến đơn vị các mặt trên biên
+    :param P_ghost: mảng (N, 4) biến nguyên thủy của lớp ô lưới ảo sát biên
+    :return: P_out - mảng (N, 4), dòng qua biên được tính bằng flux_func(P_out, P_in) hoặc flux_func(P_in, P_out)
+'''
+def supersonic_inflow_array(P_in, normals, P_ghost):
+    P_out = empty(P_in.shape)
+    P_out[:] = P_freestream
+    return P_out
+
+# dòng Roe với P_out = P_in chính là dòng P2F(P_in)
+def supersonic_outflow_array(P_in, normals, P_ghost):
+    return P_in
+
+def no_slip_array(P_in, normals, P_ghost):
+    P_out = P_in.copy()
+    P_out[:, 1:3] = 0.0
+    return P_out
+
+def symmetry_array(P_in, normals, P_ghost):
+    P_out = P_in.copy()
+    Vn = np_sum(normals * P_in[:, 1:3], axis=1)
+    P_out[:, 1:3] -= Vn[:, None] * normals
+    return P_out
+
+farfield_array = supersonic_inflow_array
+
+def outflow_array(P_in, normals, P_ghost):
+    rho_b = P_in[:, 0]*(p_exit/P_in[:, 3])**(1.0/gamma)
+    a_b = (gamma*p_exit/rho_b)**0.5
+    Vn_in = np_sum(normals * P_in[:, 1:3], axis=1)
+    a_in = VSound(P_in)
+    R_p = Vn_in + 2*a_in/(gamma_m1)
+    Vn_b = R_p - 2*a_b/(gamma_m1)
+    P_out = empty(P_in.shape)
+    P_out[:, 0] = rho_b
+    P_out[:, 1:3] = P_in[:, 1:3] + (Vn_b - Vn_in)[:, None]*normals
+    P_out[:, 3] = p_exit
+    return P_out
+
+def inflow_array(P_in, normals, P_ghost):
+    P_e = asarray(P_freestream)
+    Vn_in = np_sum(normals * P_in[:, 1:3], axis=1)
+    Vn_e  = normals.dot(P_e[1:3])
+    a_in = VSound(P_in)
+    a_e  = VSound(P_e)
+    R_p = Vn_e + 2 * a_e / (gamma_m1)
+    R_m = Vn_in - 2 * a_in / (gamma_m1)
+    Vn_b = 0.5*(R_p+R_m)
+    a_b = 0.25*(gamma_m1)*(R_p - R_m)
+    R = P_e[3]/(P_e[0]**gamma)
+    rho_b = (a_b*a_b/(gamma*R))**(1.0/gamma_m1)
+    P_out = empty(P_in.shape)
+    P_out[:, 0] = rho_b
+    P_out[:, 1:3] = P_e[1:3] + (Vn_b - Vn_e)[:, None]*normals
+    P_out[:, 3] = R*rho_b**gamma
+    return where((Mach(P_in) >= 1.0)[:, None], P_e, P_out) # dòng siêu âm: P_b = P_e
+
+def joint_array(P_in, normals, P_ghost):
+    return P_ghost
+
+# Bảng các điều kiện biên có dạng mảng, null - không có dòng qua biên
+array_bocos = {supersonic_inflow: supersonic_inflow_array,
+               supersonic_outflow: supersonic_outflow_array,
+               no_slip: no_slip_array,
+               symmetry: symmetry_array,
+               farfield: farfield_array,
+               outflow: outflow_array,
+               inflow: inflow_array,
+               joint: joint_array,
+               null: None}
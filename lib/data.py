@@ -1,11 +1,18 @@
 # coding: utf-8
 # Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
 
+from os.path import getsize
 from time import time as timer
-from numpy import cross, zeros, array, fromfile
+from math import floor
+from concurrent.futures import ThreadPoolExecutor
+from numpy import zeros, array, fromfile, minimum, maximum, arange, stack, broadcast_to, concatenate, repeat
 import matplotlib.pyplot as plt
+from .constants import gamma
 from .functions import P2U, U2P, Mach, Temperature, import_mesh
-from .solver import eu_solver
+from .fluxes import vectorized_fluxes, backend, numba_kernels, flux_registry, auto_fluxes
+from .boco import array_bocos, sign_ic
+from .solver import eu_solver, rk_schemes
+from .implicit import lusgs, lusgs_diagonal
 from setting import P_freestream, mesh_file, joint_list, boco_list, path_dir
 
 '''
@@ -25,27 +32,42 @@ def volume(vertices):
     :param vertices: array tọa độ bốn đỉnh ô lưới theo thứ tự ngược chiều KĐH
     :return: volume - thể tích ô lưới, trong trường hợp 2 chiều - diện tích ô lưới:
                       bằng một nửa độ lớn tích có hướng hai vector đường chéo
+    Note: vertices có thể là 4 mảng đỉnh (Nj, Ni, 2), khi đó kết quả là mảng (Nj, Ni)
     '''
-    return abs(cross(vertices[0] - vertices[2], vertices[1] - vertices[3]) / 2.)
+    d1 = vertices[0] - vertices[2]
+    d2 = vertices[1] - vertices[3]
+    return abs(d1[..., 0]*d2[..., 1] - d1[..., 1]*d2[..., 0]) / 2.
 
-def cell_size(vertices):
+def mean_lines(vertices):
     '''
     :param vertices: array tọa độ bốn đỉnh ô lưới theo thứ tự ngược chiều KĐH
-    :return: size  - kích thước ô lưới bằng đường trung bình nhỏ nhất
+    :return: dx_vec, dy_vec - vector hai đường trung bình của ô lưới (theo chiều i và chiều j)
     '''
     dx_vec = (vertices[1]-vertices[0] + vertices[2] - vertices[3])/2.
     dy_vec = (vertices[2]-vertices[1] + vertices[3] - vertices[0])/2.
-    dx = dx_vec.dot(dx_vec)**0.5
-    dy = dy_vec.dot(dy_vec)**0.5
-    return min(dx, dy)
+    return dx_vec, dy_vec
+
+def cell_size(vertices):
+    '''
+    :param vertices: array tọa độ bốn đỉnh ô lưới theo thứ tự ngược chiều KĐH
+    :return: size  - kích thước ô lưới bằng đường trung bình nhỏ nhất
+    '''
+    dx_vec, dy_vec = mean_lines(vertices)
+    dx = (dx_vec**2).sum(axis=-1)**0.5
+    dy = (dy_vec**2).sum(axis=-1)**0.5
+    return minimum(dx, dy)
 
 
 class Cell:
     '''
     Lớp dữ liệu Cell chứa  các thông số cơ bản của một ô lưới.
+    Cell chỉ là một "view" tới ô lưới thứ (j, i) trong các mảng dữ liệu của Cells,
+    được giữ lại để tương thích với các hàm tính theo từng ô lưới, từng bề mặt.
+
     Parameters
     ----------
-    vertices : 4 đỉnh lưới theo thứ tự ngược chiều KĐH dùng để xác định center, volume, size
+    cells : Cells chứa ô lưới
+    j, i  : chỉ số ô lưới
 
     Attributes
     ----------
@@ -59,22 +81,110 @@ class Cell:
 
     Notes
     -----
-    Tại thời điểm khởi tạo P, U, res, dt bằng 0
+    P, U, res là các view tới Cells.P[j, i], Cells.U[j, i], Cells.res[j, i]:
+    phép gán cell.P = ... ghi giá trị vào mảng của Cells.
+    '''
+    __slots__ = ('_cells', 'j', 'i', '_P', '_U', '_res')
+
+    def __init__(self, cells, j, i):
+        'Khởi tạo Cell - view tới ô lưới (j, i) của cells.'
+        self._cells = cells
+        self.j, self.i = j, i
+        self._P = cells.P[j, i]
+        self._U = cells.U[j, i]
+        self._res = cells.res[j, i]
+
+    @property
+    def center(self): return self._cells.center[self.j, self.i]
+
+    @property
+    def volume(self): return self._cells.volume[self.j, self.i]
+
+    @property
+    def size(self): return self._cells.cell_size[self.j, self.i]
+
+    @property
+    def P(self): return self._P
+
+    @P.setter
+    def P(self, value): self._P[:] = value
+
+    @property
+    def U(self): return self._U
+
+    @U.setter
+    def U(self, value): self._U[:] = value
+
+    @property
+    def res(self): return self._res
+
+    @res.setter
+    def res(self, value): self._res[:] = value
+
+    @property
+    def dt(self): return self._cells.dt[self.j, self.i]
+
+    @dt.setter
+    def dt(self, value): self._cells.dt[self.j, self.i] = value
+
+
+class GhostCell:
+    '''Ô lưới ảo bên ngoài biên, P là view tới lớp halo Cells.ghost.'''
+    __slots__ = ('P',)
+
+    def __init__(self, P):
+        self.P = P
+
+
+def smooth_lines(r, eps, axis):
     '''
-    def __init__(self, vertices):
-        'Khởi tạo Cell từ 4 đỉnh vertices.'
-        self.center   = center(vertices)
-        self.volume   = volume(vertices)
-        self.size     = cell_size(vertices)
-        self.P = zeros(4)
-        self.U = zeros(4)
-        self.res = zeros(4)
-        self.dt  = 0.0
+    Làm trơn ẩn (implicit residual smoothing) theo các đường lưới dọc trục axis của mảng r (Nj, Ni, 4):
+        -eps*r_s[k-1] + (1 + 2*eps)*r_s[k] - eps*r_s[k+1] = r[k],
+    ở hai đầu đường lưới r_s[-1] = r_s[0], r_s[N] = r_s[N-1]. Hệ ba đường chéo được giải bằng
+    thuật toán Thomas, đồng thời cho tất cả các đường lưới; kết quả được ghi vào r.
+    '''
+    x = r.swapaxes(0, axis) # view, các đường lưới theo chiều thứ nhất
+    N = x.shape[0]
+    if N < 2: return
+    if backend == 'numba':
+        numba_kernels.smooth_lines(x, eps)
+        return
+    d = zeros(N) + 1.0 + 2.0*eps
+    d[0] = d[-1] = 1.0 + eps
+    c = zeros(N)
+    c[0] = -eps/d[0]
+    x[0] /= d[0]
+    for k in range(1, N):
+        m = d[k] + eps*c[k-1]
+        c[k] = -eps/m
+        x[k] += eps*x[k-1]
+        x[k] /= m
+    for k in range(N-2, -1, -1):
+        x[k] -= c[k]*x[k+1]
+
+
+def runs(mask):
+    '''Các đoạn [(start, end), ...] gồm các phần tử True liên tiếp của mảng bool 1 chiều mask.'''
+    m = concatenate(([False], mask, [False]))
+    k = (m[1:] != m[:-1]).nonzero()[0]
+    return list(zip(k[::2], k[1::2]))
+
+
+def bound_layer(bound, l=0):
+    '''
+    Chỉ số (tuple of slices) của lớp ô lưới thứ l tính từ biên "bound" vào trong block:
+    bound_0 - cột i = l, bound_1 - cột i = Ni-1-l, bound_2 - hàng j = l, bound_3 - hàng j = Nj-1-l.
+    '''
+    if bound == 0: return (slice(None), l)
+    if bound == 1: return (slice(None), -1-l)
+    if bound == 2: return (l, slice(None))
+    return (-1-l, slice(None))
 
 
 class Cells():
     '''
     Lớp dữ liệu các ô lưới trong một block (zone).
+    Dữ liệu được lưu dưới dạng các mảng liên tục (structure of arrays).
 
     Parameters
     ----------
@@ -84,22 +194,61 @@ class Cells():
     ----------
     size:  kích thước lưới 2D ([Nj, Ni])
     len:   tổng số ô lưới (Nj*Ni)
-    cells: dãy các ô lưới "class Cell".
+    center, volume, cell_size: tọa độ tâm (Nj, Ni, 2), thể tích (Nj, Ni), kích thước (Nj, Ni)
+    mean_lines: vector hai đường trung bình của các ô lưới (Nj, Ni, 2), xem time_step_local
+    P, U, res: các mảng (Nj, Ni, 4)
+    dt:    mảng (Nj, Ni) bước thời gian trong từng ô lưới
+    ws:    mảng (Nj, Ni) vận tốc sóng lớn nhất (|V.n| + a) trên các mặt của ô lưới, được ghi lại
+           khi tính dòng bằng hàm dạng mảng (0 ở các ô lưới không hoạt động); None nếu chưa tính
+           cho trường P hiện tại. time_step_cell dùng max(ws, |V| + a)
+    U0:    U ở đầu bước lặp Runge-Kutta (None nếu không dùng)
+    smoothing: hệ số làm trơn ẩn res (xem smooth_res), 0 - không làm trơn
+    row_chunks: các đoạn hàng ô lưới [(j_start, j_end), ...] được tính song song trên pool
+    active: mảng bool các tile (nhóm tile x tile ô lưới) đang hoạt động, None - mọi ô lưới (xem set_active)
+    tiles:  các đoạn tile hoạt động [(j_start, j_end, i_start, i_end, tops), ...], tops - các đoạn cột
+            [(i_start, i_end), ...] có tile phía trên không hoạt động (xem Sides.flux_tiles)
+    frozen: mảng bool (Nj, Ni) các ô lưới không hoạt động
+    ghost: [ghost_0, ghost_1, ghost_2, ghost_3] - các lớp ô lưới ảo (halo) bên ngoài 4 biên,
+           ghost_k có kích thước (halo, Nj, 4) với biên 0, 1 và (halo, Ni, 4) với biên 2, 3,
+           lớp thứ 0 nằm sát biên.
+    cells: dãy các ô lưới "class Cell" (view), chỉ được tạo khi cần.
 
     Notes
     -----
     Ô lưới thứ (j,i) (hay thứ j*i) gồm 4 đỉnh [(j,i), (j,i+1), (j+1,i+1), (j+1,i)]
     '''
-    def __init__(self, nodes):
-        '''Khởi tạo Cells từ mảng nodes.'''
+    def __init__(self, nodes, halo=1):
+        '''Khởi tạo Cells từ mảng nodes, halo - số lớp ô lưới ảo trên mỗi biên.'''
         Nj, Ni = nodes.shape[0]-1, nodes.shape[1]-1
         self.size  = [Nj, Ni]
         self.len   = Nj*Ni
-        self.cells = []
-        for j in range(Nj):
-            for i in range(Ni):
-                vers = (nodes[j, i], nodes[j, i + 1], nodes[j + 1, i + 1], nodes[j + 1, i])
-                self.cells.append(Cell(vers))
+        vers = (nodes[:-1, :-1], nodes[:-1, 1:], nodes[1:, 1:], nodes[1:, :-1])
+        self.center    = center(vers)
+        self.volume    = volume(vers)
+        self.cell_size = cell_size(vers)
+        self.mean_lines = mean_lines(vers)
+        self.P   = zeros((Nj, Ni, 4))
+        self.U   = zeros((Nj, Ni, 4))
+        self.U0  = None
+        self.res = zeros((Nj, Ni, 4))
+        self.dt  = zeros((Nj, Ni))
+        self.ws  = None
+        self.smoothing = 0.0
+        self.pool = None
+        self.row_chunks = [(0, Nj)]
+        self.active = self.frozen = None
+        self.tiles = []
+        self.halo  = halo
+        self.ghost = [zeros((halo, Nj, 4)), zeros((halo, Nj, 4)), zeros((halo, Ni, 4)), zeros((halo, Ni, 4))]
+        self._cells = None
+
+    @property
+    def cells(self):
+        '''Dãy các ô lưới Cell (view tới các mảng dữ liệu).'''
+        if self._cells is None:
+            Nj, Ni = self.size
+            self._cells = [Cell(self, j, i) for j in range(Nj) for i in range(Ni)]
+        return self._cells
 
     def __getitem__(self, item):
         '''
@@ -115,12 +264,98 @@ class Cells():
         else: # Lấy một đoạn các ô lưới: cells[start:stop] (getslice). Lấy ô lưới thứ j*i: cells[j*i]
             return self.cells[item]
 
-    def time_step_cell(selfs):
-        '''Tính bước thời gian cục bộ trong từng ô lưới.'''
-        for cell in selfs.cells:
-            a = (1.4 * cell.P[3] / cell.P[0]) ** 0.5      # vận tốc âm thanh
-            v = (cell.P[1] ** 2 + cell.P[2] ** 2) ** 0.5  # vận tốc dòng chảy
-            cell.dt = cell.size/(v + a)
+    def set_arrays(self, P, U, res):
+        '''
+        Chuyển dữ liệu P, U, res sang các mảng cho trước (ví dụ mảng trên shared memory).
+        Các Cell (view tới mảng cũ) sẽ được tạo lại khi cần.
+        '''
+        P[:], U[:], res[:] = self.P, self.U, self.res
+        self.P, self.U, self.res = P, U, res
+        self._cells = None
+
+    def set_threads(self, pool=None, num_threads=1):
+        '''
+        Chia các hàng ô lưới thành num_threads đoạn để tính song song trên pool (ThreadPoolExecutor).
+        :param pool: None - tính tuần tự
+        '''
+        Nj = self.size[0]
+        self.pool = pool if num_threads > 1 else None
+        n = min(num_threads, Nj) if self.pool is not None else 1
+        bounds = [Nj*k//n for k in range(n+1)]
+        self.row_chunks = list(zip(bounds[:-1], bounds[1:]))
+
+    def map_rows(self, func, chunks=None):
+        '''
+        Thực hiện func((j_start, j_end)) với tất cả các đoạn hàng ô lưới, chờ tới khi tất cả đã xong.
+        :param chunks: các phần việc khác thay cho row_chunks, ví dụ tiles
+        '''
+        if chunks is None: chunks = self.row_chunks
+        if self.pool is None or len(chunks) == 1:
+            for rows in chunks: func(rows)
+        else:
+            list(self.pool.map(func, chunks))
+
+    def map_cells(self, func):
+        '''
+        Thực hiện func(j, i) với các ô lưới hoạt động: j, i - slices của các đoạn hàng ô lưới,
+        hoặc của các tile hoạt động (xem set_active).
+        '''
+        if self.active is None: self.map_rows(lambda rows: func(slice(*rows), slice(None)))
+        else: self.map_rows(lambda tile: func(slice(*tile[:2]), slice(*tile[2:4])), self.tiles)
+
+    def set_active(self, threshold=None, tile=16):
+        '''
+        Chia block thành các tile tile x tile ô lưới. Tile hoạt động nếu max |res/volume| trong tile lớn hơn
+        threshold ở ít nhất một phương trình, hoặc nếu nằm cạnh (kể cả theo đường chéo) một tile như vậy.
+        Dòng (với hàm dạng mảng), U, P chỉ được tính trong các tile hoạt động, xem Sides.flux_tiles, new_U.
+        Cần được gọi sau residual và trước update.
+        :param threshold: mảng (4,), None - mọi ô lưới đều hoạt động
+        :return: số ô lưới hoạt động
+        '''
+        self.active = self.frozen = None
+        self.tiles = []
+        if threshold is None: return self.len
+        Nj, Ni = self.size
+        r = abs(self.res/self.volume[..., None])
+        m = maximum.reduceat(maximum.reduceat(r, arange(0, Nj, tile), axis=0), arange(0, Ni, tile), axis=1)
+        a = (m > threshold).any(axis=-1)
+        b = a.copy()
+        b[1:] |= a[:-1]
+        b[:-1] |= a[1:]
+        active = b.copy()
+        active[:, 1:] |= b[:, :-1]
+        active[:, :-1] |= b[:, 1:]
+        if active.all(): return self.len
+
+        # các đoạn tile hoạt động liên tiếp trong mỗi hàng tile, bên phải mỗi đoạn là tile không hoạt động (hoặc biên)
+        for tj in range(len(active)):
+            a, b = tj*tile, min((tj + 1)*tile, Nj)
+            for p, q in runs(active[tj]):
+                tops = [] if tj + 1 == len(active) else runs(~active[tj + 1, p:q])
+                tops = [((p + k)*tile, min((p + l)*tile, Ni)) for k, l in tops]
+                self.tiles.append((a, b, p*tile, min(q*tile, Ni), tops))
+        self.active = active
+        self.frozen = ~repeat(repeat(active, tile, axis=0), tile, axis=1)[:Nj, :Ni]
+        return self.len - int(self.frozen.sum())
+
+    def layer(self, bound, l=0):
+        '''
+        Lớp ô lưới thứ l tính từ biên "bound" vào trong block.
+        :return: view (N, 4) tới mảng P
+        '''
+        return self.P[bound_layer(bound, l)]
+
+    def time_step_cell(self):
+        '''
+        Tính bước thời gian cục bộ trong từng ô lưới: dt = size/max(ws, |V| + a).
+        Vận tốc sóng trên các mặt ws (nếu có) lấy trung bình Roe nên có thể nhỏ hơn |V| + a của ô lưới,
+        vì vậy chỉ được dùng để tăng vận tốc sóng, dt không lớn hơn ước lượng theo |V| + a.
+        '''
+        P = self.P
+        a = (gamma * P[..., 3] / P[..., 0]) ** 0.5        # vận tốc âm thanh
+        w = (P[..., 1] ** 2 + P[..., 2] ** 2) ** 0.5 + a  # vận tốc dòng chảy + vận tốc âm thanh
+        if self.ws is not None: maximum(w, self.ws, out=w)
+        self.dt[:] = self.cell_size/w
 
     def time_step_global(self, CFL):
         '''
@@ -129,21 +364,85 @@ class Cells():
         :return: dt - bước thời gian cho mỗi iteration
         '''
         self.time_step_cell() # trước hết cần xác định bước thời gian trong từng ô lưới
-        dt = 1e6
-        for cell in self.cells: # sau đó tìm bước thời gian nhỏ nhất trong toàn block
-            dt = min(dt, cell.dt)          
-        return CFL*dt
+        return CFL*self.dt.min() # sau đó tìm bước thời gian nhỏ nhất trong toàn block
 
-    def new_U(self, dt):
-        '''Thực hiện bước lặp: xác định U ở bước thời gian tiếp theo.'''
-        for cell in self.cells:
-            cell.U += dt/cell.volume*cell.res # công thức: U^{n+1} = U^{n}  + dt/dx*RES
-            cell.res[:] = 0.0                 # sau khi xác định U, đưa giá trị res về 0.0
+    def time_step_local(self, CFL):
+        '''
+        Bước thời gian cục bộ trong từng ô lưới (ghi vào dt): dt = CFL*volume/(L_i + L_j),
+        L = |V.S| + a|S| - bán kính phổ theo mỗi chiều, S - vector pháp tuyến của đường trung bình ô lưới.
+        Khác với time_step_cell, tổng theo hai chiều được tính nên dt ổn định với từng ô lưới riêng lẻ.
+        :return: bước thời gian nhỏ nhất trong block
+        '''
+        P = self.P
+        a = (gamma * P[..., 3] / P[..., 0]) ** 0.5
+        L = 0.0
+        for line in self.mean_lines:
+            S = normal(line)
+            L = L + abs(P[..., 1]*S[..., 0] + P[..., 2]*S[..., 1]) + a*area(line)
+        self.dt[:] = CFL*self.volume/L
+        return self.dt.min()
+
+    def save_U(self):
+        '''Lưu U ở đầu bước lặp vào U0 (cho các phương pháp Runge-Kutta nhiều bước).'''
+        if self.U0 is None: self.U0 = zeros(self.U.shape)
+        self.U0[:] = self.U
+
+    def smooth_res(self, dt):
+        '''
+        Làm trơn ẩn số gia dt/volume*res theo các đường lưới i và j với hệ số smoothing (xem smooth_lines),
+        cho phép tăng số CFL khoảng 2-3 lần. Các blocks được làm trơn độc lập với nhau.
+        '''
+        w = ((dt if getattr(dt, 'ndim', 0) else 1.0)/self.volume)[..., None]
+        self.res *= w
+        smooth_lines(self.res, self.smoothing, 1)
+        smooth_lines(self.res, self.smoothing, 0)
+        self.res /= w
+
+    def new_U(self, dt, alpha=0.0, beta=1.0):
+        '''
+        Thực hiện bước lặp: xác định U ở bước thời gian tiếp theo.
+        Một bước Runge-Kutta dạng: U = alpha*U0 + (1 - alpha)*U + beta*dt/volume*res,
+        mặc định (alpha = 0, beta = 1) - phương pháp Euler hiện. Nếu smoothing > 0, res được làm trơn trước.
+        Chỉ các ô lưới hoạt động được cập nhật (xem set_active), res của các ô lưới khác được đưa về 0.
+        '''
+        if self.smoothing: self.smooth_res(dt)
+        self.ws = None # ws không còn đúng với trường mới
+        U, U0, res, volume = self.U, self.U0, self.res, self.volume
+        dt = broadcast_to(beta*dt, volume.shape)
+
+        def rows(j, i):
+            if alpha:
+                U[j, i] *= 1.0 - alpha
+                U[j, i] += alpha*U0[j, i]
+            if backend == 'numba':
+                numba_kernels.new_U(U[j, i], res[j, i], volume[j, i], dt[j, i])
+                return
+            U[j, i] += dt[j, i, None]/volume[j, i, None]*res[j, i] # công thức: U^{n+1} = U^{n}  + dt/dx*RES
+            res[j, i] = 0.0                                        # sau khi xác định U, đưa giá trị res về 0.0
+
+        self.map_cells(rows)
+        if self.frozen is not None: res[self.frozen] = 0.0
+
+    def check(self):
+        '''
+        Kiểm tra trạng thái vật lý: rho > 0, p > 0 trong tất cả các ô lưới (NaN không thỏa mãn).
+        :return: None, hoặc (số ô lưới không hợp lệ, j, i) - ô lưới không hợp lệ đầu tiên
+        '''
+        rho, p = self.P[..., 0], self.P[..., 3]
+        if rho.min() > 0 and p.min() > 0: return None
+        bad = ~((rho > 0) & (p > 0))
+        j, i = divmod(int(bad.argmax()), self.size[1])
+        return int(bad.sum()), j, i
 
     def new_P(self):
-        '''Thực hiện bước lặp: xác định P ở bước thời gian tiếp theo, sử dụng hàm U2P.'''
-        for cell in self.cells:
-            U2P(cell.U, cell.P)
+        '''Thực hiện bước lặp: xác định P ở bước thời gian tiếp theo (trong các ô lưới hoạt động), sử dụng hàm U2P.'''
+        U, P = self.U, self.P
+
+        def rows(j, i):
+            if backend == 'numba': numba_kernels.new_P(U[j, i], P[j, i])
+            else: U2P(U[j, i], P[j, i])
+
+        self.map_cells(rows)
 
 '''
     ------------------------------------
@@ -157,11 +456,11 @@ def area(side_vec):
     :param side_vec: vector side = (point2 - point1)
     :return: chiều dài cạnh ô lưới
     '''
-    return (side_vec.dot(side_vec))**0.5
+    return ((side_vec**2).sum(axis=-1))**0.5
 
 def normal(side_vec):
     '''xác định vector pháp tuyến của bề mặt: S*n, với n - vector pháp tuyến đơn vị'''
-    return array([side_vec[1], -side_vec[0]])
+    return stack([side_vec[..., 1], -side_vec[..., 0]], axis=-1)
 
 #định nghĩa lớp bề mặt
 class Side:
@@ -208,6 +507,10 @@ class Sides:
 
     Attributes
     ----------
+    normal_i, area_i : mảng (Nj+1, Ni, 2), (Nj+1, Ni)
+            pháp tuyến đơn vị và diện tích các sides nằm ngang (họ mặt i)
+    normal_j, area_j : mảng (Nj, Ni+1, 2), (Nj, Ni+1)
+            pháp tuyến đơn vị và diện tích các sides thẳng đứng (họ mặt j)
     bounds : list
             [bound_0, bound_1, bound_2, bound_3]
     inner_sides : list
@@ -215,88 +518,243 @@ class Sides:
     boco_list : list
             các điều kiện biên trên 4 biên [boco_bound_0, boco_bound_1, boco_bound_2, boco_bound_3],
             mỗi boco_bound_i là một list các điều kiện biên trên biên i.
+    boco_plan : list
+            các đoạn biên (boco, kernel, bound_id, range, normals, areas) lập sẵn từ boco_list,
+            kernel - hàm điều kiện biên dạng mảng trong boco.array_bocos (nếu có).
+
+    Notes
+    -----
+    Các đối tượng Side trong bounds, inner_sides chỉ được tạo khi cần (hàm tính dòng theo từng side,
+    điều kiện biên theo từng side). Với hàm tính dòng dạng mảng, dòng qua các sides bên trong
+    được tính trực tiếp trên các mảng normal_i, normal_j.
     '''
 
     def __init__(self, nodes, cells):
         '''Khởi tạo Sides từ nodes và cells.'''
         #xác định các vector bề mặt từ các điểm lưới 
-        sides_i = nodes[:, :-1] - nodes[:, 1:]   # sides nằm ngang
-        sides_j = nodes[1:] - nodes[:-1]         # sides thẳng đứng
-
-        # Biên_0 gồm các mặt ở cột đầu sides_j
-        # Ô lưới bên trái không xác định, bên phải là các ô ở cột đầu tiên
-        bound_0 = []
-        for j in range(sides_j.shape[0]):
-            side = Side(sides_j[j, 0])
-            side.cells = [None, cells[j, 0]]
-            bound_0.append(side)
-
-        # Biên_1 gồm các mặt ở cột cuối sides_j
-        # Ô lưới bên phải không xác định, bên trái là các ô ở cột cuối
-        bound_1 = []
-        for j in range(sides_j.shape[0]):
-            side = Side(sides_j[j, -1])
-            side.cells = [cells[j, -1], None]
-            bound_1.append(side)
-
-        # Biên_2 gồm các mặt ở hàng đầu sides_i
-        # Ô lưới bên phải không xác định, bên trái là các ô ở hàng đầu
-        bound_2 = []
-        for i in range(sides_i.shape[1]):
-            side = Side(sides_i[0, i])
-            side.cells = [None, cells[0, i]]
-            bound_2.append(side)
-
-        # Biên_3 gồm các mặt ở hàng cuối sides_i
-        # Ô lưới bên trái không xác định, bên phải là các ô ở hàng cuối
-        bound_3 = []
-        for i in range(sides_i.shape[1]):
-            side = Side(sides_i[-1, i])
-            side.cells = [cells[-1, i], None]
-            bound_3.append(side)
-
-        self.bounds = [bound_0, bound_1, bound_2, bound_3]
-
-        # Những hàng còn lại bên trong sides_i
-        self.inner_sides = []
-        for j in range(1, sides_i.shape[0] - 1):
-            for i in range(sides_i.shape[1]):
-                side = Side(sides_i[j, i])
-                side.cells = [cells[j - 1, i], cells[j, i]]
-                self.inner_sides.append(side)
+        self.sides_i = nodes[:, :-1] - nodes[:, 1:]   # sides nằm ngang
+        self.sides_j = nodes[1:] - nodes[:-1]         # sides thẳng đứng
+        self.cells = cells
+
+        self.area_i = area(self.sides_i)
+        self.normal_i = normal(self.sides_i)/self.area_i[..., None]
+        self.area_j = area(self.sides_j)
+        self.normal_j = normal(self.sides_j)/self.area_j[..., None]
+
+        self._bounds = None
+        self._inner_sides = None
+
+    @property
+    def bounds(self):
+        '''Các sides trên 4 biên.'''
+        if self._bounds is None:
+            sides_i, sides_j, cells = self.sides_i, self.sides_j, self.cells
+            ghost = [[GhostCell(P) for P in g[0]] for g in cells.ghost] # lớp halo sát biên
+
+            # Biên_0 gồm các mặt ở cột đầu sides_j
+            # Ô lưới bên trái là ô lưới ảo, bên phải là các ô ở cột đầu tiên
+            bound_0 = []
+            for j in range(sides_j.shape[0]):
+                side = Side(sides_j[j, 0])
+                side.cells = [ghost[0][j], cells[j, 0]]
+                bound_0.append(side)
 
-        # Những cột còn lại bên trong sides_j
-        for i in range(1, sides_j.shape[1] - 1):
+            # Biên_1 gồm các mặt ở cột cuối sides_j
+            # Ô lưới bên phải là ô lưới ảo, bên trái là các ô ở cột cuối
+            bound_1 = []
             for j in range(sides_j.shape[0]):
-                side = Side(sides_j[j, i])
-                side.cells = [cells[j, i - 1], cells[j, i]]
-                self.inner_sides.append(side)
+                side = Side(sides_j[j, -1])
+                side.cells = [cells[j, -1], ghost[1][j]]
+                bound_1.append(side)
 
-    def set_boco_list(self, boco_list):
-        '''Thiết lập giá trị thuộc tính boco_list.'''
-        self.boco_list = boco_list
+            # Biên_2 gồm các mặt ở hàng đầu sides_i
+            # Ô lưới bên trái là ô lưới ảo, bên phải là các ô ở hàng đầu
+            bound_2 = []
+            for i in range(sides_i.shape[1]):
+                side = Side(sides_i[0, i])
+                side.cells = [ghost[2][i], cells[0, i]]
+                bound_2.append(side)
 
-    def set_joint(self, boundary_0, boundary_1, ic=0):
-        '''Kết nối các mặt với điều kiện biên joint.'''
-        for side_0, side_1 in zip(boundary_0, boundary_1):
-            side_0.cells[ic] = side_1.cells[ic]
-            self.inner_sides.append(side_0)
+            # Biên_3 gồm các mặt ở hàng cuối sides_i
+            # Ô lưới bên phải là ô lưới ảo, bên trái là các ô ở hàng cuối
+            bound_3 = []
+            for i in range(sides_i.shape[1]):
+                side = Side(sides_i[-1, i])
+                side.cells = [cells[-1, i], ghost[3][i]]
+                bound_3.append(side)
+
+            self._bounds = [bound_0, bound_1, bound_2, bound_3]
+        return self._bounds
+
+    @property
+    def inner_sides(self):
+        '''Các sides bên trong vùng tính toán.'''
+        if self._inner_sides is None:
+            sides_i, sides_j, cells = self.sides_i, self.sides_j, self.cells
+
+            # Những hàng còn lại bên trong sides_i
+            self._inner_sides = []
+            for j in range(1, sides_i.shape[0] - 1):
+                for i in range(sides_i.shape[1]):
+                    side = Side(sides_i[j, i])
+                    side.cells = [cells[j - 1, i], cells[j, i]]
+                    self._inner_sides.append(side)
+
+            # Những cột còn lại bên trong sides_j
+            for i in range(1, sides_j.shape[1] - 1):
+                for j in range(sides_j.shape[0]):
+                    side = Side(sides_j[j, i])
+                    side.cells = [cells[j, i - 1], cells[j, i]]
+                    self._inner_sides.append(side)
+        return self._inner_sides
+
+    def reset_sides(self):
+        '''Xóa các Side đã tạo (chứa view tới các ô lưới), chúng sẽ được tạo lại khi cần.'''
+        self._bounds = None
+        self._inner_sides = None
+        self._boco_sides = {}
+
+    def bound_faces(self, bound):
+        '''Pháp tuyến đơn vị và diện tích các mặt trên biên "bound".'''
+        if bound == 0: return self.normal_j[:, 0], self.area_j[:, 0]
+        if bound == 1: return self.normal_j[:, -1], self.area_j[:, -1]
+        if bound == 2: return self.normal_i[0], self.area_i[0]
+        return self.normal_i[-1], self.area_i[-1]
 
-    def flux_bound_sides(self):
-        '''Tính dòng qua các side trên biên.'''
-        for i, bound in enumerate(self.bounds):
-            for boco in self.boco_list[i]: boco[0](bound[boco[1]:boco[2]], (i+1)%2)
+    def set_boco_list(self, boco_list):
+        '''Thiết lập giá trị thuộc tính boco_list, lập boco_plan cho các đoạn biên.'''
+        self.boco_list = boco_list
+        self.boco_plan = []
+        self._boco_sides = {}
+        for i, bocos in enumerate(boco_list):
+            normals, areas = self.bound_faces(i)
+            for boco in bocos:
+                seg = slice(boco[1], boco[2])
+                kernel = array_bocos.get(boco[0], boco[0])
+                self.boco_plan.append((boco[0], kernel, i, seg, normals[seg], areas[seg]))
+
+    def boco_sides(self, k):
+        '''Dãy các Side trên đoạn biên thứ k của boco_plan.'''
+        if k not in self._boco_sides:
+            boco, kernel, i, seg = self.boco_plan[k][:4]
+            self._boco_sides[k] = self.bounds[i][seg]
+        return self._boco_sides[k]
+
+    def flux_bound_sides(self, flux_func=None):
+        '''
+        Tính dòng qua các side trên biên.
+        :param flux_func: nếu là hàm tính dòng dạng mảng, các điều kiện biên trong boco.array_bocos
+                          được tính trên cả đoạn biên, các điều kiện biên khác tính theo từng side.
+        '''
+        array_mode = flux_func in vectorized_fluxes
+        P, res, ws, ghost = self.cells.P, self.cells.res, self.cells.ws, self.cells.ghost
+        for k, (boco, kernel, i, seg, normals, areas) in enumerate(self.boco_plan):
+            ic = (i+1)%2
+            if not array_mode or boco not in array_bocos:
+                boco(self.boco_sides(k), ic)
+            elif kernel is not None:
+                layer = bound_layer(i)
+                P_in = P[layer][seg]
+                P_out = kernel(P_in, normals, ghost[i][0, seg])
+                if ic == 1: F, wsn = flux_func(P_out, P_in, normals, areas, return_wsn=True)
+                else: F, wsn = flux_func(P_in, P_out, normals, areas, return_wsn=True)
+                res[layer][seg] += sign_ic(ic) * F
+                ws_in = ws[layer][seg]
+                maximum(ws_in, 2*wsn, out=ws_in)
 
     def flux_inner_sides(self, flux_func):
         '''
         Tính dòng qua các sides bên trong vùng tính.
-        :param flux_func: hàm tính dòng qua side
+        :param flux_func: hàm tính dòng qua side, hoặc hàm tính dòng dạng mảng (vectorized_fluxes)
         '''
+        if flux_func in vectorized_fluxes:
+            if self.cells.active is None: self.flux_structured(flux_func)
+            else: self.flux_tiles(flux_func)
+            return
         for side in self.inner_sides:
             F = flux_func(side, side.cells[0].P, side.cells[1].P)
             side.cells[0].res -= F # ô bên trái -
             side.cells[1].res += F # ô bên phải +
 
+    def flux_structured(self, flux_func):
+        '''
+        Tính dòng qua các sides bên trong theo hai họ mặt i, j của lưới có cấu trúc.
+        Dòng của cả họ mặt được tính một lần trên các lát cắt của mảng P, res của ô lưới
+        được cập nhật bằng hiệu dòng qua hai mặt đối diện.
+        :param flux_func: hàm tính dòng dạng mảng flux_func(PL, PR, normals, areas, return_wsn)
+        Vận tốc sóng lớn nhất 2*wsn trên các mặt được ghi vào cells.ws để tính bước thời gian.
+
+        Công việc được chia theo các đoạn hàng ô lưới cells.row_chunks (có thể tính song song):
+            1. dòng qua họ mặt i được ghi vào mảng Fi (Nj+1, Ni, 4), mỗi hàng mặt thuộc một đoạn;
+               dòng qua họ mặt j của hàng j chỉ thay đổi res của hàng j, được cộng trực tiếp;
+            2. res hàng j += Fi[j] - Fi[j+1], mỗi hàng ô lưới thuộc một đoạn.
+        Không có hai luồng nào cùng ghi vào một phần tử của res.
+        '''
+        cells = self.cells
+        P, res, ws = cells.P, cells.res, cells.ws
+        Nj, Ni = cells.size
+        Fi = zeros((Nj+1, Ni, 4)) # hàng 0 và hàng Nj là các mặt trên biên, dòng được tính trong flux_bound_sides
+        wi = zeros((Nj+1, Ni))
+
+        def faces(rows):
+            a, b = rows
+            # họ mặt i: ô bên trái (j-1, i), ô bên phải (j, i)
+            f = max(a, 1)
+            Fi[f:b], wi[f:b] = flux_func(P[f-1:b-1], P[f:b], self.normal_i[f:b], self.area_i[f:b], return_wsn=True)
+
+            # họ mặt j: ô bên trái (j, i-1), ô bên phải (j, i)
+            F, wsn = flux_func(P[a:b, :-1], P[a:b, 1:], self.normal_j[a:b, 1:-1], self.area_j[a:b, 1:-1],
+                               return_wsn=True)
+            res[a:b, :-1] -= F
+            res[a:b, 1:]  += F
+            maximum(ws[a:b, :-1], 2*wsn, out=ws[a:b, :-1])
+            maximum(ws[a:b, 1:], 2*wsn, out=ws[a:b, 1:])
+
+        def cells_rows(rows):
+            a, b = rows
+            res[a:b] += Fi[a:b] - Fi[a+1:b+1]
+            maximum(ws[a:b], 2*wi[a:b], out=ws[a:b])
+            maximum(ws[a:b], 2*wi[a+1:b+1], out=ws[a:b])
+
+        cells.map_rows(faces)
+        cells.map_rows(cells_rows)
+
+    def flux_tiles(self, flux_func):
+        '''
+        Như flux_structured, nhưng chỉ trong các đoạn tile hoạt động cells.tiles (xem Cells.set_active).
+        Mỗi đoạn tính dòng qua các mặt bên trong và trên bốn cạnh của nó, trừ các mặt trên cạnh trên
+        có tile phía trên hoạt động (được tính ở đoạn phía trên), nên mỗi mặt chỉ được tính một lần.
+        res của các ô lưới không hoạt động được đưa về 0.
+        '''
+        cells = self.cells
+        P, res, ws = cells.P, cells.res, cells.ws
+        Nj, Ni = cells.size
+        Fi, wi = zeros((Nj+1, Ni, 4)), zeros((Nj+1, Ni)) # các mặt trên biên: 0, Nj (họ mặt i), 0, Ni (họ mặt j)
+        Fj, wj = zeros((Nj, Ni+1, 4)), zeros((Nj, Ni+1))
+
+        def faces(tile):
+            a, b, c, d, tops = tile
+            # họ mặt i: ô bên trái (j-1, i), ô bên phải (j, i)
+            for f, g, k, l in [(max(a, 1), b, c, d)] + [(b, b+1, k, l) for k, l in tops]:
+                if f < g:
+                    Fi[f:g, k:l], wi[f:g, k:l] = flux_func(P[f-1:g-1, k:l], P[f:g, k:l], self.normal_i[f:g, k:l],
+                                                           self.area_i[f:g, k:l], return_wsn=True)
+            # họ mặt j: ô bên trái (j, i-1), ô bên phải (j, i)
+            f, g = max(c, 1), min(d + 1, Ni)
+            if f < g:
+                Fj[a:b, f:g], wj[a:b, f:g] = flux_func(P[a:b, f-1:g-1], P[a:b, f:g], self.normal_j[a:b, f:g],
+                                                       self.area_j[a:b, f:g], return_wsn=True)
+
+        def cells_tile(tile):
+            a, b, c, d = tile[:4]
+            res[a:b, c:d] += Fi[a:b, c:d] - Fi[a+1:b+1, c:d] + Fj[a:b, c:d] - Fj[a:b, c+1:d+1]
+            w = ws[a:b, c:d]
+            for wsn in (wi[a:b, c:d], wi[a+1:b+1, c:d], wj[a:b, c:d], wj[a:b, c+1:d+1]): maximum(w, 2*wsn, out=w)
+
+        cells.map_rows(faces, cells.tiles)
+        cells.map_rows(cells_tile, cells.tiles)
+        res[cells.frozen] = 0.0
+
 '''
     ------------------------------------
     Phần III: Lớp dữ liệu "Blocks"
@@ -314,40 +772,88 @@ class Block:
 
     Attributes
     ----------
+    name   : tên block
     BField : file chứa trường khí động 'name.field'
     BNodes : các điểm lưới
     BCells : các ô lưới "class Cells"
     BSides : các mặt "class Sides"
     BSize  : kích thước lưới
     '''
-    def __init__(self, name, nodes):
-        '''Khởi tạo Block có tên "name", có tọa độ điểm lưới "nodes".'''
+    def __init__(self, name, nodes, halo=1):
+        '''Khởi tạo Block có tên "name", có tọa độ điểm lưới "nodes", halo - số lớp ô lưới ảo.'''
+        self.name = name
         self.BField = path_dir+name+'.field'
         self.BNodes = nodes
-        self.BCellS = Cells(nodes)
+        self.BCellS = Cells(nodes, halo)
         self.BSides = Sides(nodes, self.BCellS)
         self.BSize = self.BCellS.size
 
-    def iteration(self, flux_func, dt):
+    def residual(self, flux_func):
         '''
-        Mỗi bước lặp bao gồm:
-            set_boco() : xác định các Ghost Ceels
+        Tính tổng dòng res trong các ô lưới:
             flux_bound_sides() : tính dòng qua các sides trên biên
             flux_inner_sides() : tính dòng qua các sides trong vùng tính
+        Với hàm tính dòng dạng mảng, vận tốc sóng trên các mặt được ghi lại vào BCellS.ws.
+
+        :param flux_func: hàm tính dòng qua side
+        '''
+        cells = self.BCellS
+        cells.ws = zeros(cells.size) if flux_func in vectorized_fluxes else None
+        self.BSides.flux_bound_sides(flux_func)
+        self.BSides.flux_inner_sides(flux_func)
+
+    def update(self, dt, alpha=0.0, beta=1.0):
+        '''
+        Cập nhật trường khí động:
             new_U : xác định U ở bước thời gian tiếp theo
             new_P : xác định P ở bước thời gian tiếp theo
 
-        :param flux_func: hàm tính dòng qua side
         :param dt: bước thời gian
+        :param alpha, beta: hệ số của bước Runge-Kutta, xem Cells.new_U
         '''
-        self.BSides.flux_bound_sides()
-        self.BSides.flux_inner_sides(flux_func)
-        self.BCellS.new_U(dt)
+        self.BCellS.new_U(dt, alpha, beta)
         self.BCellS.new_P()
 
+    def iteration(self, flux_func, dt):
+        '''
+        Mỗi bước lặp bao gồm:
+            residual() : tính dòng qua các sides trên biên và trong vùng tính
+            update()   : xác định U, P ở bước thời gian tiếp theo
+
+        :param flux_func: hàm tính dòng qua side
+        :param dt: bước thời gian
+        '''
+        self.residual(flux_func)
+        self.update(dt)
+
+    def update_lusgs(self, dt, omega=1.0):
+        '''
+        Cập nhật trường khí động bằng một bước ẩn LU-SGS (xem implicit.lusgs).
+        :param dt: bước thời gian - số hoặc mảng (Nj, Ni) (bước thời gian cục bộ)
+        '''
+        cells = self.BCellS
+        cells.U += lusgs(cells, self.BSides, dt, omega)
+        cells.res[:] = 0.0
+        cells.ws = None
+        cells.new_P()
+
+    def precondition(self, r, dt, method='lusgs', omega=1.0):
+        '''
+        Nghiệm gần đúng của (V/dt + dR/dU) x = r trong block (tiền điều kiện cho newton_solver).
+        :param r: mảng (Nj, Ni, 4)
+        :param method: 'lusgs' - hai lượt quét LU-SGS, 'jacobi' - chỉ dùng đường chéo D (xem implicit.lusgs_diagonal)
+        '''
+        if method == 'jacobi': return r/lusgs_diagonal(self.BCellS, self.BSides, dt, omega)[..., None]
+        return lusgs(self.BCellS, self.BSides, dt, omega, r)
+
+    def set_arrays(self, P, U, res):
+        '''Chuyển dữ liệu P, U, res của block sang các mảng cho trước, xem Cells.set_arrays.'''
+        self.BCellS.set_arrays(P, U, res)
+        self.BSides.reset_sides()
+
     def write_field(self):
         '''Ghi trường khí động dạng vào file binary BField.'''
-        BData = array([cell.P for cell in self.BCellS])
+        BData = self.BCellS.P
         f = open(self.BField, 'wb')
         BData.tofile(f)
         f.close()
@@ -357,19 +863,17 @@ class Block:
         f = open(self.BField, 'rb')
         BData = fromfile(f).reshape((self.BCellS.len, 4))
         f.close()
-        for i, cell in enumerate(self.BCellS):
-            cell.P = BData[i]
-            cell.U = P2U(BData[i])
+        cells = self.BCellS
+        cells.P[:] = BData.reshape(cells.P.shape)
+        cells.U[:] = P2U(cells.P)
 
     def init_field(self, P_t0):
         '''
         Thiết lập trường khí động tại thời điểm ban đầu.
         :param P_t0 : numpy.array(rho, u, v, p)
         '''
-        U_t0 = P2U(P_t0)
-        for cell in self.BCellS:
-            cell.P = P_t0.copy()
-            cell.U = U_t0.copy()
+        self.BCellS.P[:] = P_t0
+        self.BCellS.U[:] = P2U(P_t0)
 
 
 class Blocks():
@@ -389,20 +893,40 @@ class Blocks():
             dãy các blocks
     time_step_global:
             bước thời gian trong toàn bộ vùng tính toán
+    local_time_step:
+            True - mỗi ô lưới có bước thời gian cục bộ của nó (xem set_time_step)
     state_file:
             file trạng thái tính toán, chứ hai thông số của bước lặp cuối cùng - iter, time
+    residual_file:
+            file lịch sử hội tụ: iter, time, chuẩn L2 và Linf của res theo 4 phương trình (xem residual_norms)
+    joints:
+            joint_list đã dùng trong joint
+    halo_map:
+            bảng sao chép dữ liệu vào các lớp ô lưới ảo (halo) của các biên joint
+    pool:
+            ThreadPoolExecutor để tính song song các blocks (None - tính tuần tự), xem set_threads
+    rank:
+            số thứ tự tiến trình khi chạy bằng MPI (xem parallel.mpi_solver), chỉ tiến trình 0 xuất kết quả
     '''
-    def __init__(self, meshfile=mesh_file):
-        '''Khởi tạo Blocks từ file lưới "meshfile".'''
+    def __init__(self, meshfile=mesh_file, halo_width=1):
+        '''Khởi tạo Blocks từ file lưới "meshfile", halo_width - số lớp ô lưới ảo trên mỗi biên.'''
         start_time = timer()
         self.state_file = path_dir+'solver.state'
+        self.residual_file = path_dir+'residual.dat'
         self.time_step_global = 1e6
+        self.local_time_step = False
+        self.halo_width = halo_width
+        self.joints = None
+        self.halo_map = []
+        self.pool = None
+        self.parallel_blocks = False
+        self.rank = 0
         # số lượng block; tên block, tọa độ điểm lưới trong mỗi block
         zone_n, zone_names, zone_nodes = import_mesh(meshfile)
         self.len = zone_n
         self.blocks = []
         for n in range(zone_n):
-            block = Block(zone_names[n], zone_nodes[n])
+            block = Block(zone_names[n], zone_nodes[n], halo_width)
             self.blocks.append(block)
         print('The time taken by init_block is %f seconds!' % (timer() - start_time))
 
@@ -421,23 +945,33 @@ class Blocks():
         '''Ghi trường khí động.'''
         for block in self.blocks: block.write_field()
 
+    def read_state(self):
+        '''Đọc iter và time từ file trạng thái state_file.'''
+        with open(self.state_file, 'r') as f: line = f.readlines()[1].split()
+        return int(line[0]), float(line[1])
+
+    def write_state(self, iter, time):
+        '''Ghi iter và time vào file trạng thái state_file.'''
+        with open(self.state_file, 'w') as f: f.write('iter time:\n%d %f' % (iter, time))
+
+    def write_residual(self, iter, time, L2, Linf, new=False):
+        '''Ghi thêm một dòng iter, time, L2, Linf vào file residual_file, new - tạo file mới (có dòng tiêu đề).'''
+        with open(self.residual_file, 'w' if new else 'a') as f:
+            if new: f.write('iter time L2_rho L2_rhou L2_rhov L2_rhoE Linf_rho Linf_rhou Linf_rhov Linf_rhoE\n')
+            f.write('%d %e ' % (iter, time) + ' '.join('%.6e' % r for r in tuple(L2) + tuple(Linf)) + '\n')
+
     def init_field_test1D(self, P_left, P_right):
         '''Thiết lập điều kiện ban đầu cho test1D, lưới 1 block.'''
         start_time = timer()
         with open(self.state_file, 'w') as f: f.write('iter time:\n%d %f' % (0, 0.0))
 
-        U_left  = P2U(P_left)
-        U_right = P2U(P_right)
-
         cells = self.blocks[0].BCellS
         Ni = cells.len
         Nih = int(Ni/2)
-        for cell in cells[: Nih]:
-            cell.P = P_left.copy()
-            cell.U = U_left.copy()
-        for cell in cells[Nih:]:
-            cell.P = P_right.copy()
-            cell.U = U_right.copy()
+        left = (arange(Ni) < Nih).reshape(cells.size) # các ô lưới [: Nih] bên trái
+        cells.P[left] = P_left
+        cells.P[~left] = P_right
+        cells.U[:] = P2U(cells.P)
 
         self.write_field()
         print('The time taken by init_field is %f seconds!' % (timer() - start_time))
@@ -450,33 +984,363 @@ class Blocks():
         self.write_field()
         print('The time taken by init_field is %f seconds!' % (timer() - start_time))
 
-    def iteration(self, flux_func):
-        '''Thực hiện bước lặp thời gian.'''
-        for block in self.blocks: block.iteration(flux_func, self.time_step_global)
+    def init_field_interpolate(self, source, field_dir=path_dir, k=4, scale=1.0):
+        '''
+        Thiết lập điều kiện ban đầu từ trường khí động trên lưới khác của cùng hình học (ví dụ kết quả trên lưới thô),
+        ghi trường khí động (gọi thay cho init_field). P tại tâm mỗi ô lưới được nội suy từ k ô lưới gần nhất
+        của lưới source (trọng số 1/khoảng cách^2), các ô lưới gần nhất được tìm bằng cKDTree (scipy) trên tâm các ô lưới.
+        :param source: Blocks đã có trường khí động, hoặc file lưới - trường khí động được đọc từ các file
+                       field_dir + tên block + '.field'. Nếu field_dir trùng path_dir, các file cùng tên block
+                       bị ghi đè bởi kết quả nội suy, nên tốt nhất hãy chép kết quả trên lưới source sang thư mục khác.
+        :param scale: hệ số (hoặc (sx, sy)) nhân với tọa độ lưới source, ví dụ 0.0254 - từ inch sang mét
+        ValueError nếu hình chữ nhật bao quanh hai lưới khác nhau, nếu có ô lưới nằm xa lưới source hơn kích thước
+        ô lưới source gần nhất (lưới khác hình học, khác đơn vị đo), hoặc nếu file .field không khớp với lưới source.
+        '''
+        from scipy.spatial import cKDTree
+        start_time = timer()
+        if isinstance(source, str):
+            source = Blocks(source, self.halo_width)
+            for block in source.blocks:
+                block.BField = field_dir + block.name + '.field'
+                if getsize(block.BField) != block.BCellS.P.nbytes:
+                    raise ValueError('init_field_interpolate: %s does not match block %s of the source mesh'
+                                     % (block.BField, block.name))
+            source.read_field()
+        centers = concatenate([block.BCellS.center.reshape(-1, 2) for block in source.blocks])*scale
+        P = concatenate([block.BCellS.P.reshape(-1, 4) for block in source.blocks])
+        # kích thước ô lưới source: đường trung bình dài nhất
+        size = concatenate([maximum(*[((v*scale)**2).sum(axis=-1)**0.5 for v in block.BCellS.mean_lines]).ravel()
+                            for block in source.blocks])
+        tree = cKDTree(centers)
+        k = min(k, len(centers))
+
+        # hai lưới cần có cùng hình chữ nhật bao quanh (sai khác không quá 10% kích thước theo mỗi chiều)
+        def box(blocks, scale=1.0):
+            nodes = concatenate([block.BNodes.reshape(-1, 2) for block in blocks.blocks])*scale
+            return nodes.min(axis=0), nodes.max(axis=0)
+        (lo, hi), (lo_s, hi_s) = box(self), box(source, scale)
+        if (abs(lo - lo_s) > 0.1*(hi_s - lo_s)).any() or (abs(hi - hi_s) > 0.1*(hi_s - lo_s)).any():
+            raise ValueError('init_field_interpolate: bounding box %s - %s differs from the source mesh %s - %s, '
+                             'check the geometry and scale' % (lo, hi, lo_s, hi_s))
+
+        queries = []
+        for block in self.blocks:
+            d, ids = tree.query(block.BCellS.center.reshape(-1, 2), k)
+            d, ids = d.reshape(-1, k), ids.reshape(-1, k)
+            outside = d[:, 0] > size[ids[:, 0]]
+            if outside.any():
+                raise ValueError('init_field_interpolate: %d cells of block %s are outside the source mesh '
+                                 '(distance up to %.3g source cells), check the geometry and scale'
+                                 % (outside.sum(), block.name, (d[:, 0]/size[ids[:, 0]]).max()))
+            queries.append((d, ids))
+
+        with open(self.state_file, 'w') as f: f.write('iter time:\n%d %f' % (0, 0.0))
+        for block, (d, ids) in zip(self.blocks, queries):
+            cells = block.BCellS
+            w = 1.0/(d**2 + 1e-300)
+            w /= w.sum(axis=1)[:, None]
+            cells.P[:] = (w[..., None]*P[ids]).sum(axis=1).reshape(cells.P.shape)
+            cells.U[:] = P2U(cells.P)
+        self.write_field()
+        print('The time taken by init_field_interpolate is %f seconds!' % (timer() - start_time))
+
+    def set_threads(self, num_threads=1):
+        '''
+        Thiết lập số luồng (thread) tính song song.
+        Các blocks độc lập với nhau giữa hai lần exchange_halo, các hàm tính dòng FORTRAN (roe_batch),
+        numba và các phép tính numpy trên mảng lớn không giữ GIL nên các luồng chạy song song thực sự.
+        Nếu số blocks không nhỏ hơn số luồng: mỗi luồng tính một block (parallel_blocks),
+        ngược lại các blocks được tính lần lượt, công việc trong mỗi block được chia theo các hàng ô lưới.
+        :param num_threads: số luồng, 1 - tính tuần tự
+        '''
+        if self.pool is not None: self.pool.shutdown()
+        self.pool = ThreadPoolExecutor(num_threads) if num_threads > 1 else None
+        self.parallel_blocks = self.pool is not None and self.len >= num_threads
+        for block in self.blocks:
+            block.BCellS.set_threads(None if self.parallel_blocks else self.pool, num_threads)
+
+    def map_blocks(self, func, *args):
+        '''
+        Thực hiện func(block, *items) với tất cả các blocks, song song nếu có pool.
+        Hàm chỉ trả về khi tất cả các blocks đã xong (barrier).
+        :param args: các dãy cùng độ dài với blocks, items - các phần tử tương ứng với block
+        :return: list các kết quả
+        '''
+        if not self.parallel_blocks: return [func(*items) for items in zip(self.blocks, *args)]
+        return list(self.pool.map(func, self.blocks, *args))
+
+    def residual(self, flux_func):
+        '''Sao chép dữ liệu vào các lớp ô lưới ảo, tính tổng dòng res trong tất cả các blocks.'''
+        self.exchange_halo()
+        self.map_blocks(lambda block: block.residual(flux_func))
+
+    def set_smoothing(self, eps=0.0):
+        '''Hệ số làm trơn ẩn res trong tất cả các blocks (xem Cells.smooth_res), 0 - không làm trơn.'''
+        for block in self.blocks: block.BCellS.smoothing = eps
+
+    def save_U(self):
+        '''Lưu U ở đầu bước lặp (cho các phương pháp Runge-Kutta nhiều bước).'''
+        self.map_blocks(lambda block: block.BCellS.save_U())
+
+    def update(self, dt=None, alpha=0.0, beta=1.0):
+        '''
+        Cập nhật trường khí động với bước thời gian dt, mặc định - bước thời gian từ set_time_step:
+        time_step_global hoặc bước thời gian cục bộ Cells.dt của từng ô lưới (local_time_step).
+        alpha, beta - hệ số của bước Runge-Kutta, xem Cells.new_U.
+        '''
+        if dt is None and self.local_time_step:
+            self.map_blocks(lambda block: block.update(block.BCellS.dt, alpha, beta))
+            return
+        if dt is None: dt = self.time_step_global
+        self.map_blocks(lambda block: block.update(dt, alpha, beta))
+
+    def update_lusgs(self, dt=None, omega=1.0):
+        '''Cập nhật trường khí động bằng một bước LU-SGS, dt - như trong update.'''
+        if dt is None and self.local_time_step:
+            self.map_blocks(lambda block: block.update_lusgs(block.BCellS.dt, omega))
+            return
+        if dt is None: dt = self.time_step_global
+        self.map_blocks(lambda block: block.update_lusgs(dt, omega))
+
+    def get_U(self):
+        '''U của toàn bộ vùng tính dạng vector (nối các mảng U của các blocks).'''
+        return concatenate([zeros(0)] + [block.BCellS.U.ravel() for block in self.blocks])
+
+    def set_U(self, x):
+        '''Gán U từ vector x (xem get_U) và xác định lại P, mọi ô lưới trở lại hoạt động (xem set_active).'''
+        for block, U in zip(self.blocks, self.split_vector(x)):
+            block.BCellS.set_active(None)
+            block.BCellS.U[:] = U
+            block.BCellS.ws = None
+            block.BCellS.new_P()
+
+    def residual_vector(self, flux_func):
+        '''Tổng dòng res của toàn bộ vùng tính dạng vector (như get_U), res được đưa về 0 trước khi tính.'''
+        for block in self.blocks: block.BCellS.res[:] = 0.0
+        self.residual(flux_func)
+        return concatenate([block.BCellS.res.ravel() for block in self.blocks])
+
+    def split_vector(self, x):
+        '''Chia vector x (như get_U) thành các mảng (Nj, Ni, 4) của các blocks (view).'''
+        parts, start = [], 0
+        for block in self.blocks:
+            shape = block.BCellS.U.shape
+            parts.append(x[start:start + block.BCellS.U.size].reshape(shape))
+            start += block.BCellS.U.size
+        return parts
+
+    def block_time_steps(self):
+        '''Bước thời gian từ set_time_step của từng block: mảng Cells.dt (local_time_step) hoặc time_step_global.'''
+        return [block.BCellS.dt if self.local_time_step else self.time_step_global for block in self.blocks]
+
+    def time_step_vector(self):
+        '''volume/dt của toàn bộ vùng tính dạng vector (như get_U), dt - từ set_time_step.'''
+        return concatenate([broadcast_to((block.BCellS.volume/dt)[..., None], block.BCellS.U.shape).ravel()
+                            for block, dt in zip(self.blocks, self.block_time_steps())])
+
+    def precondition(self, r, method='lusgs', omega=1.0):
+        '''
+        Tiền điều kiện cho vector r (như get_U), dt - từ set_time_step, xem Block.precondition.
+        Các blocks được tính độc lập (block-Jacobi giữa các blocks).
+        '''
+        x = self.map_blocks(lambda block, rb, dt: block.precondition(rb, dt, method, omega),
+                            self.split_vector(r), self.block_time_steps())
+        return concatenate([xb.ravel() for xb in x])
+
+    def residual_norm(self):
+        '''
+        Chuẩn của res (phương trình liên tục): sqrt(tổng (res/volume)^2 / số ô lưới) trên toàn bộ vùng tính.
+        Cần được gọi sau residual và trước update (update đưa res về 0).
+        '''
+        sums = self.map_blocks(lambda block: ((block.BCellS.res[..., 0]/block.BCellS.volume)**2).sum())
+        n = sum(block.BCellS.len for block in self.blocks)
+        return (self.reduce_sum(sum(sums))/self.reduce_sum(n))**0.5
+
+    def residual_norms(self):
+        '''
+        Chuẩn của res/volume theo 4 phương trình trên toàn bộ vùng tính (gọi như residual_norm):
+            L2 = sqrt(tổng (res/volume)^2 / số ô lưới),  Linf = max |res/volume|
+        :return: L2, Linf - hai mảng (4,)
+        '''
+        def norms(block):
+            r = abs(block.BCellS.res/block.BCellS.volume[..., None]).reshape(-1, 4)
+            return (r**2).sum(axis=0), r.max(axis=0)
+        results = self.map_blocks(norms)
+        n = self.reduce_sum(sum(block.BCellS.len for block in self.blocks))
+        L2 = array([(self.reduce_sum(sum(s[k] for s, m in results))/n)**0.5 for k in range(4)])
+        Linf = array([self.reduce_max(max((m[k] for s, m in results), default=0.0)) for k in range(4)])
+        return L2, Linf
+
+    def set_active(self, tol=None, tile=16):
+        '''
+        Các tile hoạt động trong tất cả các blocks (xem Cells.set_active): ngưỡng của max |res/volume| trong tile
+        bằng tol*max |res/volume| trên toàn bộ vùng tính (theo từng phương trình). Gọi như residual_norms.
+        :param tol: None - mọi ô lưới đều hoạt động
+        :return: tỉ lệ số ô lưới hoạt động
+        '''
+        threshold = None if tol is None else tol*self.residual_norms()[1]
+        n = self.map_blocks(lambda block: block.BCellS.set_active(threshold, tile))
+        return self.reduce_sum(sum(n))/self.reduce_sum(sum(block.BCellS.len for block in self.blocks))
+
+    def reduce_sum(self, value):
+        '''Tổng của value trên các phần của vùng tính (một tiến trình: value), xem parallel.BlocksPart.'''
+        return value
+
+    def reduce_max(self, value):
+        '''Giá trị lớn nhất của value trên các phần của vùng tính (một tiến trình: value).'''
+        return value
+
+    def check(self):
+        '''
+        Kiểm tra trạng thái vật lý (rho > 0, p > 0) trong tất cả các blocks, xem Cells.check.
+        Các ô lưới không hợp lệ đầu tiên được in ra (tên block, chỉ số, tọa độ tâm, P).
+        :return: số ô lưới không hợp lệ trên toàn bộ vùng tính
+        '''
+        n = 0
+        for block, bad in zip(self.blocks, self.map_blocks(lambda block: block.BCellS.check())):
+            if bad is None: continue
+            count, j, i = bad
+            cells = block.BCellS
+            print('non-physical state in block %s: %d cells, first cell (j, i) = (%d, %d), center: %s, P: %s'
+                  % (block.name, count, j, i, cells.center[j, i], cells.P[j, i]))
+            n += count
+        return self.reduce_sum(n)
+
+    def iteration(self, flux_func, scheme='euler'):
+        '''
+        Thực hiện bước lặp thời gian với bước thời gian từ set_time_step.
+        :param scheme: phương pháp tích phân theo thời gian, tên trong solver.rk_schemes hoặc 'lusgs'
+        '''
+        if scheme == 'lusgs':
+            self.residual(flux_func)
+            self.update_lusgs()
+            return
+        stages = rk_schemes[scheme]
+        if len(stages) > 1: self.save_U()
+        for alpha, beta in stages:
+            self.residual(flux_func)
+            self.update(None, alpha, beta)
+
+    def find_joints(self, tol=None):
+        '''
+        Tìm các joint - các đoạn biên trùng nhau giữa các blocks (và trong một block) theo tọa độ điểm lưới.
+        Các điểm lưới trên biên được đánh số qua bảng băm các ô vuông cạnh tol: các điểm cách nhau không quá tol
+        là một điểm; hai mặt trên biên có cùng hai điểm đầu mút được nối với nhau, các mặt liên tiếp
+        tạo thành một joint. Joint phải có cùng chiều đánh số các mặt trên hai biên (mặt s1+k nối với mặt s2+k),
+        các đoạn biên trùng nhau nhưng ngược chiều không được nối.
+        :param tol: sai số tọa độ, mặc định 1e-3 kích thước ô lưới nhỏ nhất
+        :return: joint_list
+        '''
+        if tol is None: tol = 1e-3*min(block.BCellS.cell_size.min() for block in self.blocks)
+        bins, points = {}, []
+        def node_id(p):
+            kx, ky = floor(p[0]/tol), floor(p[1]/tol)
+            for key in [(kx + dx, ky + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]:
+                for n in bins.get(key, []):
+                    if abs(points[n][0] - p[0]) <= tol and abs(points[n][1] - p[1]) <= tol: return n
+            points.append(p)
+            bins.setdefault((kx, ky), []).append(len(points) - 1)
+            return len(points) - 1
+
+        # faces: mặt (điểm đầu, điểm cuối) -> (blk_id, bound_id, side_id) chưa được nối
+        faces, pairs, reversed_faces = {}, [], 0
+        for b, block in enumerate(self.blocks):
+            for bound in range(4):
+                ids = [node_id(p) for p in block.BNodes[bound_layer(bound)]]
+                for k in range(len(ids) - 1):
+                    face = (ids[k], ids[k+1])
+                    if face[0] == face[1]: continue # mặt suy biến
+                    if face in faces: pairs.append(faces.pop(face) + (b, bound, k))
+                    elif face[::-1] in faces:
+                        faces.pop(face[::-1])
+                        reversed_faces += 1
+                    else: faces[face] = (b, bound, k)
+        if reversed_faces: print('find_joints: %d reversed faces are not joined' % reversed_faces)
+
+        joints = []
+        for b1, bound1, k1, b2, bound2, k2 in sorted(pairs):
+            last = joints[-1] if joints else None
+            if last and last[:2] == [b1, bound1] and last[4:6] == [b2, bound2] and last[3] == k1 and last[7] == k2:
+                last[3] += 1
+                last[7] += 1
+            else: joints.append([b1, bound1, k1, k1 + 1, b2, bound2, k2, k2 + 1])
+        joints = [tuple(joint) for joint in joints]
+        print('find_joints: %d joints' % len(joints))
+        return joints
 
     def joint(self, joints = joint_list):
         '''
-        Kết nối các biên có điều kiện biên joint.
-        :param  joint_list : [joint_0, joint_1, ...]
+        Kết nối các biên có điều kiện biên joint: lập bảng sao chép halo_map.
+        Mỗi joint cho hai chiều sao chép: các lớp ô lưới bên trong block 2 (kề biên 2)
+        vào các lớp ô lưới ảo của biên 1 block 1 và ngược lại.
+        :param  joint_list : [joint_0, joint_1, ...] hoặc 'auto' - tìm các joint bằng find_joints
                 joint_0 = [blk1_id, bound1_id, start_side1_id, end_side1_id,
                            blk2_id, bound2_id, start_side2_id, end_side2_id]
         '''
+        if joints == 'auto': joints = self.find_joints()
+        self.joints = joints
+        self.halo_map = []
         if joints is not None:
             for joint in joints:
-                left_BSides = self.blocks[joint[0]].BSides
-                left_bound = left_BSides.bounds[joint[1]][joint[2]:joint[3]]
-
-                right_BSides = self.blocks[joint[4]].BSides
-                right_bound = right_BSides.bounds[joint[5]][joint[6]:joint[7]]
-
-                out_cell_id = joint[1]%2
-                left_BSides.set_joint(left_bound, right_bound, ic=out_cell_id)
-
-    def set_time_step(self, CFL):
-        '''Xác định bước thời gian trong toàn bộ vùng tính.'''
+                side_1 = (joint[0], joint[1], slice(joint[2], joint[3]))
+                side_2 = (joint[4], joint[5], slice(joint[6], joint[7]))
+                for l in range(self.halo_width):
+                    self.halo_map.append(side_1 + side_2 + (l,))
+                    self.halo_map.append(side_2 + side_1 + (l,))
+
+    def exchange_halo(self):
+        '''Sao chép dữ liệu vào các lớp ô lưới ảo theo bảng halo_map.'''
+        for dst_blk, dst_bound, dst_range, src_blk, src_bound, src_range, l in self.halo_map:
+            src = self.blocks[src_blk].BCellS
+            dst = self.blocks[dst_blk].BCellS
+            dst.ghost[dst_bound][l, dst_range] = src.layer(src_bound, l)[src_range]
+
+    def n_sides(self):
+        '''Tổng số mặt (bên trong và trên biên) của tất cả các blocks.'''
+        return sum(block.BSides.area_i.size + block.BSides.area_j.size for block in self.blocks)
+
+    def benchmark_flux(self, flux_func, iters=3):
+        '''
+        Đo tốc độ tính dòng của flux_func trên trường khí động hiện tại: chạy iters lần residual
+        (sau một lần chạy thử để biên dịch JIT nếu có), trường P, U không thay đổi.
+        :return: số lần tính dòng qua mặt trong một giây
+        '''
+        self.residual(flux_func)
+        start_time = timer()
+        for n in range(iters): self.residual(flux_func)
+        elapsed = timer() - start_time
         for block in self.blocks:
-            dt = block.BCellS.time_step_global(CFL)
-            self.time_step_global = min(self.time_step_global, dt)
+            block.BCellS.res[:] = 0.0
+            block.BCellS.ws = None
+        return iters*self.n_sides()/elapsed
+
+    def select_flux(self, flux_func):
+        '''
+        Xác định hàm tính dòng từ flux_func trong setting.py:
+        hàm, tên trong fluxes.flux_registry hoặc 'auto' - thử các hàm trong fluxes.auto_fluxes
+        trên lưới đang tính và chọn hàm nhanh nhất.
+        '''
+        if callable(flux_func): return flux_func
+        if flux_func != 'auto': return flux_registry[flux_func]
+        speed = {}
+        for name in auto_fluxes:
+            speed[name] = self.benchmark_flux(flux_registry[name])
+            print('flux %s: %.3e face-fluxes/second' % (name, speed[name]))
+        name = max(speed, key=speed.get)
+        print('flux_func = %s\n' % name)
+        return flux_registry[name]
+
+    def set_time_step(self, CFL, local=False):
+        '''
+        Xác định bước thời gian trong toàn bộ vùng tính.
+        :param local: True - bước thời gian cục bộ (cho bài toán dừng): mỗi ô lưới được cập nhật với
+                      bước thời gian của nó, không bị giới hạn bởi ô lưới nhỏ nhất (xem update)
+        :return: bước thời gian nhỏ nhất trong toàn bộ vùng tính
+        '''
+        self.local_time_step = local
+        if local: dts = self.map_blocks(lambda block: block.BCellS.time_step_local(CFL))
+        else: dts = self.map_blocks(lambda block: block.BCellS.time_step_global(CFL))
+        self.time_step_global = min(dts, default=1e6)
         return self.time_step_global
 
     def run(self, solver=eu_solver, joints=joint_list, bocos=boco_list):
@@ -495,7 +1359,8 @@ class Blocks():
         print('**************************************************')
 
     def export_block_data(self, filename):
-        '''Xuất trường khí động vào file định dạng Tecplot block data.'''
+        '''Xuất trường khí động vào file định dạng Tecplot block data (chỉ tiến trình 0).'''
+        if self.rank > 0: return
         filename = path_dir + filename
         print('Write block data to: %s' % filename)
         f = open(filename, 'w')
@@ -516,33 +1381,29 @@ class Blocks():
             for y in Y_p: f.write('%f ' % y)
             f.write('\n')
 
+            P = cells.P.reshape((cells.len, 4))
             for i in range(4):
-                for cell in cells: f.write('%f ' % cell.P[i])
+                for p in P[:, i]: f.write('%f ' % p)
                 f.write('\n')
-            for cell in cells:
-                M = Mach(cell.P)
-                f.write('%f ' % M)
-            for cell in cells:
-                T = Temperature(cell.P)
-                f.write('%f ' % T)
+            for M in Mach(P): f.write('%f ' % M)
+            for T in Temperature(P): f.write('%f ' % T)
             f.write('\n')
         f.close()
 
     def plot_field(self, field='rho', pfunc='pcolor'):
-        '''Plot trường khí động. Tốt nhất hãy sử dụng Paraview!'''
+        '''Plot trường khí động (chỉ tiến trình 0). Tốt nhất hãy sử dụng Paraview!'''
+        if self.rank > 0: return
         id = {'rho':0, 'u':1, 'v':2, 'p':3}
         for block in self.blocks:
             nodes = block.BNodes
             cells = block.BCellS
-            Nj, Ni = cells.size[0], cells.size[1]
-            value_c = array([cell.P[id[field]] for cell in cells]).reshape((Nj, Ni))
+            value_c = cells.P[:, :, id[field]]
 
             if pfunc == 'pcolor':
                 X_p, Y_p = nodes[:, :, 0], nodes[:, :, 1]
                 pcm = plt.pcolor(X_p, Y_p, value_c)
             else:
-                centers = array([cell.center for cell in cells]).reshape((Nj, Ni, 2))
-                X_c, Y_c = centers[:, :, 0], centers[:, :, 1]
+                X_c, Y_c = cells.center[:, :, 0], cells.center[:, :, 1]
                 pcm = plt.contourf(X_c, Y_c, value_c)
 
         plt.title(field)
@@ -2,9 +2,33 @@
 # Nguyên mẫu FORTRAN - Katate Masatsuka
 # Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
 
-from numpy import zeros
+from numpy import zeros, ones, empty, sqrt, abs as np_abs, where
 from .constants import gamma, gamma_m1
-from .fluxes_fortran import roe
+
+# Backend của các hàm roe, roe_batch: FORTRAN (fluxes_fortran.so) nếu import được,
+# nếu không (chưa biên dịch, khác phiên bản Python/numpy) - numba, cuối cùng - numpy (xem cuối file).
+# fluxes_fortran.so biên dịch trước khi có roe_batch vẫn được dùng cho roe, chỉ roe_batch dùng backend thay thế.
+try:
+    from .fluxes_fortran import roe
+    backend = 'fortran'
+except ImportError as error:
+    fortran_error = error
+    backend = None
+
+try:
+    from .fluxes_fortran import roe_batch
+except ImportError:
+    roe_batch = None
+
+try:
+    from . import numba_kernels
+except ImportError:
+    numba_kernels = None
+
+if backend is None and numba_kernels is not None:
+    roe, roe_batch = numba_kernels.roe, numba_kernels.roe_batch
+    backend = 'numba'
+fortran_batch = backend == 'fortran' and roe_batch is not None
 
 def flux_roe_fortran(side, PL, PR):
     njk = side.normal
@@ -81,7 +105,7 @@ def flux_roe_python(side, PL, PR):
     Rv[0, 2] = 1.0
     Rv[1, 2] = vx
     Rv[2, 2] = vy
-    Rv[3, 1] = 0.5 * (vx * vx + vy * vy)
+    Rv[3, 2] = 0.5 * (vx * vx + vy * vy)
 
     Rv[0, 3] = 1.0
     Rv[1, 3] = vx + a * nx
@@ -109,3 +133,136 @@ def flux_roe_python(side, PL, PR):
 
     Roe = 0.5 * (fL + fR - diss) * side.area
     return Roe
+
+
+def flux_roe_vectorized(PL, PR, normals, areas, return_wsn=False):
+    '''
+    Hàm tính dòng Roe (có entropy fix của Harten) cho cả một mảng các bề mặt.
+    :param PL, PR: mảng (N, 4) biến nguyên thủy bên trái, bên phải các bề mặt
+    :param normals: mảng (N, 2) vector pháp tuyến đơn vị (L -> R)
+    :param areas: mảng (N,) diện tích các bề mặt
+    :param return_wsn: trả thêm wsn - một nửa vận tốc sóng lớn nhất (giống hàm roe FORTRAN)
+    :return: mảng (N, 4) dòng qua các bề mặt
+    '''
+    nx, ny = normals[..., 0], normals[..., 1]
+    mx, my = -ny, nx
+
+    # Left state
+    rhoL, uL, vL, pL = PL[..., 0], PL[..., 1], PL[..., 2], PL[..., 3]
+    unL = uL * nx + vL * ny
+    umL = uL * mx + vL * my
+    HL = pL / rhoL * gamma / gamma_m1 + 0.5 * (uL * uL + vL * vL)
+
+    # Right state
+    rhoR, uR, vR, pR = PR[..., 0], PR[..., 1], PR[..., 2], PR[..., 3]
+    unR = uR * nx + vR * ny
+    umR = uR * mx + vR * my
+    HR = pR / rhoR * gamma / gamma_m1 + 0.5 * (uR * uR + vR * vR)
+
+    # First compute the Roe Averages
+    RT = sqrt(rhoR / rhoL)
+    rho = RT * rhoL
+    u = (uL + RT * uR) / (1.0 + RT)
+    v = (vL + RT * vR) / (1.0 + RT)
+    H = (HL + RT * HR) / (1.0 + RT)
+    q2 = 0.5 * (u * u + v * v)
+    a = sqrt(gamma_m1 * (H - q2))
+    un = u * nx + v * ny
+    um = u * mx + v * my
+
+    # Wave Strengths
+    dp = pR - pL
+    dun = unR - unL
+    LdU0 = (dp - rho * a * dun) / (2.0 * a * a)
+    LdU1 = rho * (umR - umL)
+    LdU2 = (rhoR - rhoL) - dp / (a * a)
+    LdU3 = (dp + rho * a * dun) / (2.0 * a * a)
+
+    # Wave Speed, Harten's Entropy Fix JCP(1983), 49, pp357-393:
+    # only for the nonlinear fields.
+    ws0 = np_abs(un - a)
+    ws0 = where(ws0 < 0.2, 0.5 * (ws0 * ws0 / 0.2 + 0.2), ws0)
+    ws1 = np_abs(un)
+    ws3 = np_abs(un + a)
+    ws3 = where(ws3 < 0.2, 0.5 * (ws3 * ws3 / 0.2 + 0.2), ws3)
+
+    # Dissipation Term: diss = sum(ws*LdU*Rv), Rv - Right Eigenvectors
+    w0, w1, w2, w3 = ws0 * LdU0, ws1 * LdU1, ws1 * LdU2, ws3 * LdU3
+    flux = empty(PL.shape)
+    fL, fR = rhoL * unL, rhoR * unR
+    flux[..., 0] = 0.5 * (fL + fR - (w0 + w2 + w3))
+    flux[..., 1] = 0.5 * (fL * uL + pL * nx + fR * uR + pR * nx
+                          - (w0 * (u - a * nx) + w1 * mx + w2 * u + w3 * (u + a * nx)))
+    flux[..., 2] = 0.5 * (fL * vL + pL * ny + fR * vR + pR * ny
+                          - (w0 * (v - a * ny) + w1 * my + w2 * v + w3 * (v + a * ny)))
+    flux[..., 3] = 0.5 * (fL * HL + fR * HR
+                          - (w0 * (H - un * a) + w1 * um + w2 * q2 + w3 * (H + un * a)))
+    flux *= areas[..., None]
+    if return_wsn: return flux, 0.5 * (np_abs(un) + a)
+    return flux
+
+
+def flux_batch(batch, PL, PR, normals, areas, return_wsn=False):
+    '''
+    Gọi hàm batch(primL, primR, njk) -> flux, wsn với các mảng (4, n) cho cả một mảng các bề mặt.
+    Tham số giống hàm flux_roe_vectorized, PL, PR, normals có thể có dạng (..., 4), (..., 2).
+    '''
+    shape = PL.shape
+    if PL.size == 0: # không có bề mặt nào
+        return (zeros(shape), zeros(shape[:-1])) if return_wsn else zeros(shape)
+    PL = PL.reshape((-1, 4))
+    PR = PR.reshape((-1, 4))
+    flux, wsn = batch(PL.T, PR.T, normals.reshape((-1, 2)).T)
+    flux = flux.T.reshape(shape) * areas[..., None]
+    if return_wsn: return flux, wsn.reshape(shape[:-1])
+    return flux
+
+def flux_roe_fortran_batch(PL, PR, normals, areas, return_wsn=False):
+    '''
+    Hàm tính dòng Roe cho cả một mảng các bề mặt bằng hàm roe_batch FORTRAN (vòng lặp trong FORTRAN).
+    Nếu không có roe_batch trong fluxes_fortran, roe_batch là hàm của backend thay thế (numba hoặc numpy).
+    '''
+    return flux_batch(roe_batch, PL, PR, normals, areas, return_wsn)
+
+def flux_roe_numba(PL, PR, normals, areas, return_wsn=False):
+    '''Hàm tính dòng Roe cho cả một mảng các bề mặt, biên dịch JIT bằng numba.'''
+    return flux_batch(numba_kernels.roe_batch, PL, PR, normals, areas, return_wsn)
+
+
+# Backend numpy: roe, roe_batch tính bằng hàm flux_roe_vectorized
+def roe_python(primL, primR, njk):
+    flux, wsn = flux_roe_vectorized(primL[None], primR[None], njk[None], ones(1), return_wsn=True)
+    return flux[0], wsn[0]
+
+def roe_batch_python(primL, primR, njk):
+    flux, wsn = flux_roe_vectorized(primL.T, primR.T, njk.T, ones(primL.shape[1]), return_wsn=True)
+    return flux.T, wsn
+
+if backend is None:
+    roe, roe_batch = roe_python, roe_batch_python
+    backend = 'python'
+if backend != 'fortran':
+    print('fluxes_fortran is not available (%s), using %s backend.' % (fortran_error, backend))
+elif roe_batch is None:
+    roe_batch = numba_kernels.roe_batch if numba_kernels is not None else roe_batch_python
+    print('fluxes_fortran has no roe_batch (rebuild it, see README), using %s roe_batch.'
+          % ('numba' if numba_kernels is not None else 'python'))
+
+
+# Các hàm tính dòng dạng mảng: flux_func(PL, PR, normals, areas)
+vectorized_fluxes = [flux_roe_vectorized, flux_roe_fortran_batch]
+if numba_kernels is not None: vectorized_fluxes.append(flux_roe_numba)
+
+# Bảng các hàm tính dòng theo tên, flux_func trong setting.py có thể là hàm hoặc tên trong bảng.
+# flux_func = 'auto': chọn hàm nhanh nhất trong auto_fluxes trên lưới đang tính (Blocks.select_flux).
+flux_registry = {'roe_python': flux_roe_python,
+                 'roe_fortran': flux_roe_fortran,
+                 'roe_vectorized': flux_roe_vectorized,
+                 'roe_fortran_batch': flux_roe_fortran_batch}
+if numba_kernels is not None: flux_registry['roe_numba'] = flux_roe_numba
+
+# Các hàm được thử khi chọn tự động: chỉ các hàm dạng mảng (hàm tính theo từng side luôn chậm hơn nhiều),
+# roe_fortran_batch chỉ được thử khi có roe_batch FORTRAN (nếu không nó trùng với backend thay thế).
+auto_fluxes = ['roe_vectorized']
+if fortran_batch: auto_fluxes.append('roe_fortran_batch')
+if numba_kernels is not None: auto_fluxes.append('roe_numba')
@@ -157,3 +157,40 @@
   wsn = half*(abs(un) + a)  !Normal max wave speed times half
   !return
  end subroutine roe
+
+!********************************************************************************
+!* -- Roe's Flux Function for an array of faces ---
+!*
+!*  Input:   primL(1:4, n) =  left states (rhoL, uL, vL, pL) of n faces
+!*           primR(1:4, n) = right states (rhoR, uR, vR, pR) of n faces
+!*             njk(1:2, n) = Face normals (L -> R). Must be unit vectors.
+!*
+!* Output:    flux(1:4, n) = numerical fluxes
+!*                  wsn(n) = half the max wave speeds
+!*
+!* Arrays (4, n) in Fortran order have the same memory layout as (n, 4) C arrays
+!* in numpy, so contiguous (n, 4) arrays are passed without copying.
+!* The loop runs without the GIL (f2py threadsafe).
+!********************************************************************************
+ subroutine roe_batch(n, primL, primR, njk, flux, wsn)
+  implicit none
+
+ !Input:
+  integer, intent(in) :: n
+  real(8), intent( in) :: primL(4, n), primR(4, n)
+  real(8), intent( in) :: njk(2, n)
+
+ !Output
+  real(8), intent(out) :: flux(4, n)
+  real(8), intent(out) :: wsn(n)
+
+!f2py threadsafe
+!f2py integer intent(hide), depend(primL) :: n = shape(primL, 1)
+
+  integer :: i
+
+  do i = 1, n
+   call roe(primL(:, i), primR(:, i), njk(:, i), flux(:, i), wsn(i))
+  end do
+
+ end subroutine roe_batch
@@ -1,16 +1,18 @@
 # coding: utf-8
 # Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
 
-from numpy import array, zeros, loadtxt, sin, cos, deg2rad
+from numpy import array, asarray, zeros, loadtxt, sin, cos, deg2rad
 from re import findall
 from .constants import gamma, gamma_m1, R_gas
 
+# P, U có thể là mảng (..., 4) chứa biến của nhiều ô lưới
 def P2U(P):
-    U = zeros(4)
-    U[0] = P[0]
-    U[1] = P[0] * P[1]
-    U[2] = P[0] * P[2]
-    U[3] = P[3] / gamma_m1 + 0.5 * P[0] * (P[1] ** 2 + P[2] ** 2)
+    P = asarray(P, dtype=float)
+    U = zeros(P.shape)
+    U[..., 0] = P[..., 0]
+    U[..., 1] = P[..., 0] * P[..., 1]
+    U[..., 2] = P[..., 0] * P[..., 2]
+    U[..., 3] = P[..., 3] / gamma_m1 + 0.5 * P[..., 0] * (P[..., 1] ** 2 + P[..., 2] ** 2)
     return U
 
 # Hàm P2F: tính dòng qua mặt (công thức ở bài 18)
@@ -26,10 +28,10 @@ def P2F(P, side):
 
 # Hàm U2P: xác định biến biên thủy P từ biến bảo toàn U
 def U2P(U, P):
-    P[0] = U[0]
-    P[1] = U[1] / U[0]
-    P[2] = U[2] / U[0]
-    P[3] = (U[3] - 0.5 * P[0] * (P[1] ** 2 + P[2] ** 2)) * gamma_m1
+    P[..., 0] = U[..., 0]
+    P[..., 1] = U[..., 1] / U[..., 0]
+    P[..., 2] = U[..., 2] / U[..., 0]
+    P[..., 3] = (U[..., 3] - 0.5 * P[..., 0] * (P[..., 1] ** 2 + P[..., 2] ** 2)) * gamma_m1
 
 
 # hàm xác định khối lượng riêng phụ thuộc nhiệt độ và áp suất
@@ -38,16 +40,16 @@ def rho(T, p):
     return p/(R_gas*T)
 
 def Temperature(P):
-    return P[3]/(R_gas*P[0])
+    return P[..., 3]/(R_gas*P[..., 0])
 
 # vận tốc âm thanh
 def VSound(P):
-    return (gamma * P[3] / P[0]) ** 0.5
+    return (gamma * P[..., 3] / P[..., 0]) ** 0.5
 
 # hàm tính số mach
 def Mach(P):
-    a = (gamma * P[3] / P[0]) ** 0.5
-    u = (P[1] * P[1] + P[2] * P[2]) ** 0.5
+    a = (gamma * P[..., 3] / P[..., 0]) ** 0.5
+    u = (P[..., 1] * P[..., 1] + P[..., 2] * P[..., 2]) ** 0.5
     M = u / a
     return M
 
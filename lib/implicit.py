@@ -0,0 +1,101 @@
+# coding: utf-8
+# Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
+
+# Phương pháp ẩn LU-SGS (lower-upper symmetric Gauss-Seidel, Yoon - Jameson) cho bài toán dừng:
+#   (V/dt + dR/dU) dU = res,  res = -R - tổng dòng vào ô lưới (giống Cells.res)
+# Jacobian của dòng được xấp xỉ bằng tách bán kính phổ: A+- = (A +- omega*L)/2, L = |V.n| + a,
+# nên không cần lập ma trận, mỗi bước lặp gồm hai lượt quét Gauss-Seidel trên mỗi block:
+#   lượt xuôi:   D dU* = res - sum_{lower} 1/2*S*(dF_nb - omega*L_nb*dU*_nb)
+#   lượt ngược:  dU = dU* - 1/D * sum_{upper} 1/2*S*(dF_nb - omega*L_nb*dU_nb)
+#   D = V/dt + omega/2 * sum_{faces} L*S,  dF_nb = F(U_nb + dU_nb).n - F(U_nb).n
+# Các ô lưới được quét theo đường chéo i + j: các ô trên một đường chéo không phụ thuộc nhau
+# nên được tính đồng thời (numpy); với backend numba các ô được quét theo thứ tự (j, i) - cùng kết quả.
+# Các ô lưới ngoài block (trên biên) được coi là không đổi (dU = 0).
+
+from numpy import zeros, arange, ascontiguousarray
+from .constants import gamma, gamma_m1
+from .fluxes import backend, numba_kernels
+
+
+def spectral_radius(P, normals):
+    '''Bán kính phổ |V.n| + a của Jacobian dòng theo pháp tuyến normals, P - mảng (..., 4).'''
+    a = (gamma * P[..., 3] / P[..., 0]) ** 0.5
+    return abs(P[..., 1]*normals[..., 0] + P[..., 2]*normals[..., 1]) + a
+
+
+def euler_flux(U, normals):
+    '''
+    Dòng Euler F(U).n qua mặt có pháp tuyến đơn vị normals, U - mảng biến bảo toàn (..., 4).
+    :return: F - mảng (..., 4), L - bán kính phổ |V.n| + a
+    '''
+    rho = U[..., 0]
+    u, v = U[..., 1]/rho, U[..., 2]/rho
+    p = gamma_m1*(U[..., 3] - 0.5*rho*(u*u + v*v))
+    un = u*normals[..., 0] + v*normals[..., 1]
+    F = zeros(U.shape)
+    F[..., 0] = rho*un
+    F[..., 1] = U[..., 1]*un + p*normals[..., 0]
+    F[..., 2] = U[..., 2]*un + p*normals[..., 1]
+    F[..., 3] = (U[..., 3] + p)*un
+    return F, abs(un) + (gamma*p/rho)**0.5
+
+
+def off_diagonal(U_nb, dU_nb, normals, areas, omega):
+    '''1/2*S*(dF_nb - omega*L_nb*dU_nb) - ảnh hưởng của ô lưới bên cạnh, normals hướng từ ô lưới ra ngoài.'''
+    F0, L = euler_flux(U_nb, normals)
+    F1 = euler_flux(U_nb + dU_nb, normals)[0]
+    return 0.5*areas[..., None]*(F1 - F0 - omega*L[..., None]*dU_nb)
+
+
+def lusgs_diagonal(cells, sides, dt, omega=1.0):
+    '''
+    D = V/dt + omega/2 * tổng L*S trên bốn mặt của ô lưới, dt - số hoặc mảng (Nj, Ni).
+    '''
+    P = cells.P
+    ni, Ai, nj, Aj = sides.normal_i, sides.area_i, sides.normal_j, sides.area_j
+    LS = (spectral_radius(P, ni[:-1])*Ai[:-1] + spectral_radius(P, ni[1:])*Ai[1:] +
+          spectral_radius(P, nj[:, :-1])*Aj[:, :-1] + spectral_radius(P, nj[:, 1:])*Aj[:, 1:])
+    return cells.volume/dt + 0.5*omega*LS
+
+
+def lusgs(cells, sides, dt, omega=1.0, res=None):
+    '''
+    Một bước LU-SGS trên block: giải (V/dt + dR/dU) dU = res gần đúng bằng hai lượt quét.
+    :param dt: bước thời gian - số hoặc mảng (Nj, Ni) (bước thời gian cục bộ)
+    :param omega: hệ số bán kính phổ (>= 1), lớn hơn - ổn định hơn nhưng hội tụ chậm hơn
+    :param res: vế phải (Nj, Ni, 4), mặc định cells.res
+    :return: dU - mảng (Nj, Ni, 4)
+    '''
+    U = cells.U
+    if res is None: res = cells.res
+    ni, Ai, nj, Aj = sides.normal_i, sides.area_i, sides.normal_j, sides.area_j
+    D = lusgs_diagonal(cells, sides, dt, omega)
+    dU = zeros(U.shape)
+    if backend == 'numba':
+        numba_kernels.lusgs(U, ascontiguousarray(res), D, ni, Ai, nj, Aj, omega, dU)
+        return dU
+
+    Nj, Ni = cells.size
+    diagonals = []
+    for d in range(Ni + Nj - 1):
+        j = arange(max(0, d - Ni + 1), min(d, Nj - 1) + 1)
+        diagonals.append((j, d - j))
+
+    # lượt xuôi: các ô bên cạnh (j, i-1), (j-1, i) đã được tính
+    for j, i in diagonals:
+        r = res[j, i]
+        m = i > 0
+        r[m] -= off_diagonal(U[j[m], i[m]-1], dU[j[m], i[m]-1], -nj[j[m], i[m]], Aj[j[m], i[m]], omega)
+        m = j > 0
+        r[m] -= off_diagonal(U[j[m]-1, i[m]], dU[j[m]-1, i[m]], -ni[j[m], i[m]], Ai[j[m], i[m]], omega)
+        dU[j, i] = r/D[j, i, None]
+
+    # lượt ngược: các ô bên cạnh (j, i+1), (j+1, i) đã được tính
+    for j, i in diagonals[::-1]:
+        s = zeros((len(j), 4))
+        m = i < Ni - 1
+        s[m] += off_diagonal(U[j[m], i[m]+1], dU[j[m], i[m]+1], nj[j[m], i[m]+1], Aj[j[m], i[m]+1], omega)
+        m = j < Nj - 1
+        s[m] += off_diagonal(U[j[m]+1, i[m]], dU[j[m]+1, i[m]], ni[j[m]+1, i[m]], Ai[j[m]+1, i[m]], omega)
+        dU[j, i] -= s/D[j, i, None]
+    return dU
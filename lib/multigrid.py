@@ -0,0 +1,161 @@
+# coding: utf-8
+# Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
+
+# Multigrid FAS (full approximation storage) cho bài toán dừng trên các block có cấu trúc.
+# Lưới thô của mỗi block gồm các điểm lưới nodes[::2, ::2]: mỗi ô lưới thô gồm 4 ô lưới mịn,
+# các điều kiện biên và joint giữ nguyên, chỉ số các mặt trên biên được chia 2.
+# Trên mỗi lưới thô giải res(U) + forcing = 0 bằng bước lặp hiện (giống eu_solver), trong đó
+#   forcing = tổng res_mịn của 4 ô lưới mịn - res(U_thô),  U_thô = trung bình U_mịn theo thể tích,
+# nên ban đầu vế trái bằng res của lưới mịn. Sau đó hiệu chỉnh U_thô - U_thô ban đầu được cộng vào
+# 4 ô lưới mịn tương ứng (có thể làm trơn ẩn hiệu chỉnh trước, xem data.smooth_lines).
+# Chu trình V: mỗi lưới thô một lần, chu trình W: hai lần trên mỗi lưới thô.
+# Bước lặp hiện dùng để làm trơn cần dập tắt các dao động ngắn: các phương pháp nhiều bước 'jameson4', 'jameson5'
+# hoặc 'euler' với CFL = 0.5 (với CFL = 1.0 cần làm trơn hiệu chỉnh, ví dụ smoothing = 0.5).
+
+from .data import Blocks, Block, smooth_lines
+
+
+def can_coarsen(blocks):
+    '''Kiểm tra: số ô lưới trong mỗi block và chỉ số đầu mút của các đoạn biên, joint đều chẵn.'''
+    for block in blocks:
+        Nj, Ni = block.BCellS.size
+        if Nj % 2 or Ni % 2: return False
+        for bound, bocos in enumerate(block.BSides.boco_list):
+            n = Nj if bound < 2 else Ni
+            for boco in bocos:
+                if any(k % 2 for k in slice(boco[1], boco[2]).indices(n)[:2]): return False
+    for b1, bound1, s1, e1, b2, bound2, s2, e2 in (blocks.joints or []):
+        n1, n2 = blocks[b1].BCellS.size[bound1 > 1], blocks[b2].BCellS.size[bound2 > 1]
+        if any(k % 2 for k in slice(s1, e1).indices(n1)[:2] + slice(s2, e2).indices(n2)[:2]): return False
+    return True
+
+
+def coarsen(blocks):
+    '''
+    Lưới thô của blocks: các block với nodes[::2, ::2], cùng điều kiện biên và joint (chỉ số mặt chia 2).
+    :return: Blocks, hoặc None nếu không chia được (xem can_coarsen)
+    '''
+    if not can_coarsen(blocks): return None
+    coarse = Blocks.__new__(Blocks)
+    coarse.__dict__.update(blocks.__dict__)
+    coarse.pool = None
+    coarse.parallel_blocks = False
+    coarse.blocks = []
+    for block in blocks:
+        new = Block(block.name, block.BNodes[::2, ::2], blocks.halo_width)
+        size = block.BCellS.size
+        bocos = [[(boco[0],) + tuple(k//2 for k in slice(boco[1], boco[2]).indices(size[bound > 1])[:2])
+                  for boco in bocos] for bound, bocos in enumerate(block.BSides.boco_list)]
+        new.BSides.set_boco_list(bocos)
+        new.BCellS.smoothing = block.BCellS.smoothing
+        coarse.blocks.append(new)
+    joints = None
+    if blocks.joints is not None:
+        joints = []
+        for b1, bound1, s1, e1, b2, bound2, s2, e2 in blocks.joints:
+            s1, e1 = slice(s1, e1).indices(blocks[b1].BCellS.size[bound1 > 1])[:2]
+            s2, e2 = slice(s2, e2).indices(blocks[b2].BCellS.size[bound2 > 1])[:2]
+            joints.append((b1, bound1, s1//2, e1//2, b2, bound2, s2//2, e2//2))
+    coarse.joint(joints)
+    return coarse
+
+
+def restrict(fine, coarse):
+    '''U_thô = trung bình U của 4 ô lưới mịn theo thể tích, xác định lại P_thô.'''
+    VU = fine.volume[..., None]*fine.U
+    V = fine.volume[::2, ::2] + fine.volume[1::2, ::2] + fine.volume[::2, 1::2] + fine.volume[1::2, 1::2]
+    coarse.U[:] = (VU[::2, ::2] + VU[1::2, ::2] + VU[::2, 1::2] + VU[1::2, 1::2])/V[..., None]
+    coarse.new_P()
+
+
+def restrict_res(fine):
+    '''Tổng res của 4 ô lưới mịn (res là tổng dòng qua các mặt của ô lưới).'''
+    res = fine.res
+    return res[::2, ::2] + res[1::2, ::2] + res[::2, 1::2] + res[1::2, 1::2]
+
+
+def prolong(dU, fine, eps=0.0):
+    '''
+    Cộng hiệu chỉnh dU (Nj/2, Ni/2, 4) của lưới thô vào 4 ô lưới mịn tương ứng, xác định lại P.
+    :param eps: hệ số làm trơn ẩn dU theo hai chiều, 0 - không làm trơn
+    '''
+    if eps:
+        smooth_lines(dU, eps, 1)
+        smooth_lines(dU, eps, 0)
+    for dj in (0, 1):
+        for di in (0, 1): fine.U[dj::2, di::2] += dU
+    fine.ws = None
+    fine.new_P()
+
+
+class Multigrid:
+    '''
+    Các lưới thô của blocks và chu trình FAS.
+
+    Parameters
+    ----------
+    blocks : Blocks - lưới mịn, đã được joint và set_boco_list (như trong Blocks.run)
+    levels : số lưới lớn nhất (tính cả lưới mịn), bị giới hạn bởi can_coarsen
+    cycle  : 'V' hoặc 'W'
+    smoothing : hệ số làm trơn ẩn hiệu chỉnh từ lưới thô (xem prolong)
+
+    Attributes
+    ----------
+    levels:  [blocks, lưới thô 1, lưới thô 2, ...]
+    forcing: forcing[l] - list các mảng forcing (Nj, Ni, 4) của các block trên lưới l (lưới mịn: None)
+    '''
+    def __init__(self, blocks, levels=2, cycle='V', smoothing=0.0):
+        # các lưới thô được lập từ toàn bộ vùng tính, không dùng với phần Blocks của một tiến trình
+        if hasattr(blocks, 'all_blocks'):
+            raise ValueError('Multigrid: blocks must be the whole computational domain, not a part of mp_solver, mpi_solver')
+        self.levels = [blocks]
+        while len(self.levels) < levels:
+            coarse = coarsen(self.levels[-1])
+            if coarse is None: break
+            self.levels.append(coarse)
+        self.gamma = 2 if cycle == 'W' else 1
+        self.smoothing = smoothing
+        self.forcing = [None]*len(self.levels)
+        sizes = ', '.join('x'.join(str(n) for n in level[0].BCellS.size) for level in self.levels)
+        print('multigrid: %d levels, %s-cycle, block 0: %s' % (len(self.levels), cycle, sizes))
+
+    def residual(self, l, flux_func):
+        '''res + forcing trên lưới l (res được đưa về 0 trước khi tính).'''
+        level = self.levels[l]
+        for block in level.blocks: block.BCellS.res[:] = 0.0
+        level.residual(flux_func)
+        if self.forcing[l] is not None:
+            for block, forcing in zip(level.blocks, self.forcing[l]): block.BCellS.res += forcing
+
+    def smooth(self, l, flux_func, CFL, local, stages):
+        '''Một bước lặp hiện trên lưới l với forcing (giống bước lặp trong eu_solver).'''
+        level = self.levels[l]
+        if len(stages) > 1: level.save_U()
+        for stage, (alpha, beta) in enumerate(stages):
+            self.residual(l, flux_func)
+            if stage == 0: level.set_time_step(CFL, local)
+            level.update(None, alpha, beta)
+
+    def cycle(self, flux_func, CFL, local, stages, l=0):
+        '''
+        Hiệu chỉnh U trên lưới l bằng các lưới thô hơn (lưới l đã được làm trơn bằng bước lặp hiện).
+        :param stages: các bước Runge-Kutta của bước lặp hiện, xem solver.rk_schemes
+        '''
+        if l + 1 >= len(self.levels): return
+        fine, coarse = self.levels[l], self.levels[l + 1]
+        self.residual(l, flux_func)
+        for fb, cb in zip(fine.blocks, coarse.blocks): restrict(fb.BCellS, cb.BCellS)
+        R = [restrict_res(fb.BCellS) for fb in fine.blocks]
+        for fb in fine.blocks: fb.BCellS.res[:] = 0.0
+
+        self.forcing[l + 1] = None
+        self.residual(l + 1, flux_func)
+        self.forcing[l + 1] = [r - cb.BCellS.res for r, cb in zip(R, coarse.blocks)]
+        for cb in coarse.blocks: cb.BCellS.res[:] = 0.0
+        U0 = [cb.BCellS.U.copy() for cb in coarse.blocks]
+
+        for k in range(self.gamma):
+            self.smooth(l + 1, flux_func, CFL, local, stages)
+            self.cycle(flux_func, CFL, local, stages, l + 1)
+
+        for fb, cb, U in zip(fine.blocks, coarse.blocks, U0): prolong(cb.BCellS.U - U, fb.BCellS, self.smoothing)
@@ -0,0 +1,174 @@
+# coding: utf-8
+# Nguyên mẫu FORTRAN - Katate Masatsuka
+# Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
+
+# Các hàm tính toán được biên dịch JIT bằng numba, dùng thay cho fluxes_fortran.so
+# khi không import được module FORTRAN (chưa biên dịch, khác phiên bản Python/numpy...).
+# cache=True: mã máy được lưu lại trong __pycache__ (hoặc NUMBA_CACHE_DIR),
+# các lần chạy sau không phải biên dịch lại.
+
+from numpy import empty
+from numba import njit
+from .constants import gamma, gamma_m1
+
+@njit(cache=True, nogil=True)
+def roe_face(primL, primR, nx, ny, flux):
+    '''
+    Dòng Roe qua một mặt (giống subroutine roe trong fluxes_fortran.f90), ghi vào flux.
+    :return: wsn - một nửa vận tốc sóng lớn nhất
+    '''
+    mx = -ny
+    my = nx
+
+    # Left state
+    rhoL, uL, vL, pL = primL[0], primL[1], primL[2], primL[3]
+    unL = uL * nx + vL * ny
+    umL = uL * mx + vL * my
+    HL = pL / rhoL * gamma / gamma_m1 + 0.5 * (uL * uL + vL * vL)
+
+    # Right state
+    rhoR, uR, vR, pR = primR[0], primR[1], primR[2], primR[3]
+    unR = uR * nx + vR * ny
+    umR = uR * mx + vR * my
+    HR = pR / rhoR * gamma / gamma_m1 + 0.5 * (uR * uR + vR * vR)
+
+    # First compute the Roe Averages
+    RT = (rhoR / rhoL) ** 0.5
+    rho = RT * rhoL
+    u = (uL + RT * uR) / (1.0 + RT)
+    v = (vL + RT * vR) / (1.0 + RT)
+    H = (HL + RT * HR) / (1.0 + RT)
+    q2 = 0.5 * (u * u + v * v)
+    a = (gamma_m1 * (H - q2)) ** 0.5
+    un = u * nx + v * ny
+    um = u * mx + v * my
+
+    # Wave Strengths
+    dp = pR - pL
+    dun = unR - unL
+    LdU0 = (dp - rho * a * dun) / (2.0 * a * a)
+    LdU1 = rho * (umR - umL)
+    LdU2 = (rhoR - rhoL) - dp / (a * a)
+    LdU3 = (dp + rho * a * dun) / (2.0 * a * a)
+
+    # Wave Speed, Harten's Entropy Fix JCP(1983), 49, pp357-393:
+    # only for the nonlinear fields.
+    ws0 = abs(un - a)
+    if ws0 < 0.2: ws0 = 0.5 * (ws0 * ws0 / 0.2 + 0.2)
+    ws1 = abs(un)
+    ws3 = abs(un + a)
+    if ws3 < 0.2: ws3 = 0.5 * (ws3 * ws3 / 0.2 + 0.2)
+
+    # Dissipation Term: diss = sum(ws*LdU*Rv), Rv - Right Eigenvectors
+    w0, w1, w2, w3 = ws0 * LdU0, ws1 * LdU1, ws1 * LdU2, ws3 * LdU3
+    fL, fR = rhoL * unL, rhoR * unR
+    flux[0] = 0.5 * (fL + fR - (w0 + w2 + w3))
+    flux[1] = 0.5 * (fL * uL + pL * nx + fR * uR + pR * nx
+                     - (w0 * (u - a * nx) + w1 * mx + w2 * u + w3 * (u + a * nx)))
+    flux[2] = 0.5 * (fL * vL + pL * ny + fR * vR + pR * ny
+                     - (w0 * (v - a * ny) + w1 * my + w2 * v + w3 * (v + a * ny)))
+    flux[3] = 0.5 * (fL * HL + fR * HR
+                     - (w0 * (H - un * a) + w1 * um + w2 * q2 + w3 * (H + un * a)))
+    return 0.5 * (abs(un) + a)
+
+@njit(cache=True, nogil=True)
+def roe(primL, primR, njk):
+    '''Cùng giao diện với roe của fluxes_fortran: flux, wsn = roe(primL, primR, njk).'''
+    flux = empty(4)
+    wsn = roe_face(primL, primR, njk[0], njk[1], flux)
+    return flux, wsn
+
+@njit(cache=True, nogil=True)
+def roe_batch(primL, primR, njk):
+    '''Cùng giao diện với roe_batch của fluxes_fortran: mảng (4, n) -> flux (4, n), wsn (n).'''
+    n = primL.shape[1]
+    flux = empty((n, 4))
+    wsn = empty(n)
+    for k in range(n):
+        wsn[k] = roe_face(primL[:, k], primR[:, k], njk[0, k], njk[1, k], flux[k])
+    return flux.T, wsn
+
+@njit(cache=True, nogil=True)
+def new_U(U, res, volume, dt):
+    '''U += dt/volume*res, res = 0; dt - mảng (Nj, Ni).'''
+    Nj, Ni = volume.shape
+    for j in range(Nj):
+        for i in range(Ni):
+            c = dt[j, i] / volume[j, i]
+            for k in range(4):
+                U[j, i, k] += c * res[j, i, k]
+                res[j, i, k] = 0.0
+
+@njit(cache=True, nogil=True)
+def new_P(U, P):
+    '''Xác định P từ U (giống hàm U2P).'''
+    Nj, Ni = U.shape[0], U.shape[1]
+    for j in range(Nj):
+        for i in range(Ni):
+            rho = U[j, i, 0]
+            u = U[j, i, 1] / rho
+            v = U[j, i, 2] / rho
+            P[j, i, 0] = rho
+            P[j, i, 1] = u
+            P[j, i, 2] = v
+            P[j, i, 3] = (U[j, i, 3] - 0.5 * rho * (u * u + v * v)) * gamma_m1
+
+@njit(cache=True, nogil=True)
+def smooth_lines(x, eps):
+    '''Làm trơn ẩn theo chiều thứ nhất của mảng x (N, M, 4), giống hàm data.smooth_lines.'''
+    N, M = x.shape[0], x.shape[1]
+    c = empty(N)
+    m = 1.0 + eps
+    c[0] = -eps/m
+    for j in range(M):
+        for k in range(4): x[0, j, k] /= m
+    for n in range(1, N):
+        m = (1.0 + eps if n == N-1 else 1.0 + 2.0*eps) + eps*c[n-1]
+        c[n] = -eps/m
+        for j in range(M):
+            for k in range(4): x[n, j, k] = (x[n, j, k] + eps*x[n-1, j, k])/m
+    for n in range(N-2, -1, -1):
+        for j in range(M):
+            for k in range(4): x[n, j, k] -= c[n]*x[n+1, j, k]
+
+@njit(cache=True, nogil=True)
+def euler_flux(U, nx, ny, F):
+    '''Dòng Euler F(U).n ghi vào F, trả về bán kính phổ |V.n| + a (giống implicit.euler_flux).'''
+    rho = U[0]
+    u = U[1] / rho
+    v = U[2] / rho
+    p = gamma_m1 * (U[3] - 0.5 * rho * (u * u + v * v))
+    un = u * nx + v * ny
+    F[0] = rho * un
+    F[1] = U[1] * un + p * nx
+    F[2] = U[2] * un + p * ny
+    F[3] = (U[3] + p) * un
+    return abs(un) + (gamma * p / rho) ** 0.5
+
+@njit(cache=True, nogil=True)
+def off_diagonal(U_nb, dU_nb, nx, ny, area, omega, r, sign):
+    '''r += sign * 1/2*S*(dF_nb - omega*L_nb*dU_nb), xem implicit.off_diagonal.'''
+    F0 = empty(4)
+    F1 = empty(4)
+    U1 = U_nb + dU_nb
+    L = euler_flux(U_nb, nx, ny, F0)
+    euler_flux(U1, nx, ny, F1)
+    for k in range(4): r[k] += sign * 0.5 * area * (F1[k] - F0[k] - omega * L * dU_nb[k])
+
+@njit(cache=True, nogil=True)
+def lusgs(U, res, D, ni, Ai, nj, Aj, omega, dU):
+    '''Hai lượt quét LU-SGS theo thứ tự (j, i), kết quả ghi vào dU (xem implicit.lusgs).'''
+    Nj, Ni = D.shape
+    r = empty(4)
+    for j in range(Nj):
+        for i in range(Ni):
+            for k in range(4): r[k] = res[j, i, k]
+            if i > 0: off_diagonal(U[j, i-1], dU[j, i-1], -nj[j, i, 0], -nj[j, i, 1], Aj[j, i], omega, r, -1.0)
+            if j > 0: off_diagonal(U[j-1, i], dU[j-1, i], -ni[j, i, 0], -ni[j, i, 1], Ai[j, i], omega, r, -1.0)
+            for k in range(4): dU[j, i, k] = r[k] / D[j, i]
+    for j in range(Nj-1, -1, -1):
+        for i in range(Ni-1, -1, -1):
+            for k in range(4): r[k] = 0.0
+            if i < Ni-1: off_diagonal(U[j, i+1], dU[j, i+1], nj[j, i+1, 0], nj[j, i+1, 1], Aj[j, i+1], omega, r, 1.0)
+            if j < Nj-1: off_diagonal(U[j+1, i], dU[j+1, i], ni[j+1, i, 0], ni[j+1, i, 1], Ai[j+1, i], omega, r, 1.0)
+            for k in range(4): dU[j, i, k] -= r[k] / D[j, i]
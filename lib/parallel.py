@@ -0,0 +1,458 @@
+# coding: utf-8
+# Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
+
+# Tính song song bằng nhiều tiến trình (process): mỗi tiến trình tính một nhóm blocks.
+# Trong mỗi tiến trình hàm eu_solver được gọi với BlocksPart - phần của Blocks thuộc tiến trình đó,
+# các hàm exchange_halo, set_time_step của BlocksPart trao đổi dữ liệu với các tiến trình khác.
+#   mp_solver  - các tiến trình trên một máy, dữ liệu nằm trên shared memory;
+#   mpi_solver - các tiến trình MPI (mpi4py), có thể trên nhiều máy.
+# split_blocks chia các blocks lớn thành các blocks nhỏ gần bằng nhau để cân bằng tải giữa các tiến trình,
+# merge_blocks ghép trường khí động về các blocks ban đầu.
+
+import os
+import sys
+import traceback
+from time import time as timer
+from multiprocessing import get_context
+from numpy import ndarray, ascontiguousarray
+from .data import Blocks, Block
+from .boco import joint
+from .solver import eu_solver
+from .fluxes import flux_registry
+import setting as set
+from setting import joint_list, boco_list
+
+
+def distribute_blocks(blocks, n):
+    '''
+    Chia các blocks thành n nhóm có tổng số ô lưới gần bằng nhau (block lớn được chia trước).
+    :return: list n list các chỉ số block
+    '''
+    groups = [[] for k in range(n)]
+    load = [0]*n
+    order = sorted(range(blocks.len), key=lambda b: -blocks[b].BCellS.len)
+    for b in order:
+        k = load.index(min(load))
+        groups[k].append(b)
+        load[k] += blocks[b].BCellS.len
+    return [sorted(group) for group in groups]
+
+
+def split_box(box, k, min_size=1):
+    '''
+    Chia vùng ô lưới box = (j0, j1, i0, i1) thành k phần gần bằng nhau: chia theo chiều có nhiều ô lưới hơn
+    thành hai phần tỉ lệ k//2 : k - k//2, rồi chia tiếp mỗi phần. Mỗi phần có ít nhất min_size ô lưới
+    theo mỗi chiều (nếu không chia được, số phần nhỏ hơn k).
+    :return: list các vùng (j0, j1, i0, i1)
+    '''
+    j0, j1, i0, i1 = box
+    if k < 2: return [box]
+    k1 = k//2
+    if j1 - j0 > i1 - i0:
+        m = j0 + int(round((j1 - j0)*k1/k))
+        boxes = (j0, m, i0, i1), (m, j1, i0, i1)
+        if min(m - j0, j1 - m) < min_size: return [box]
+    else:
+        m = i0 + int(round((i1 - i0)*k1/k))
+        boxes = (j0, j1, i0, m), (j0, j1, m, i1)
+        if min(m - i0, i1 - m) < min_size: return [box]
+    return split_box(boxes[0], k1, min_size) + split_box(boxes[1], k - k1, min_size)
+
+
+def bound_range(box, bound, size):
+    '''
+    Đoạn biên "bound" của block ban đầu (kích thước size = (Nj, Ni)) trùng với biên "bound" của vùng box.
+    :return: (lo, hi) - chỉ số các mặt trên biên của block ban đầu, None - biên nằm bên trong block ban đầu
+    '''
+    j0, j1, i0, i1 = box
+    if bound == 0: return (j0, j1) if i0 == 0 else None
+    if bound == 1: return (j0, j1) if i1 == size[1] else None
+    if bound == 2: return (i0, i1) if j0 == 0 else None
+    return (i0, i1) if j1 == size[0] else None
+
+
+def bound_len(bound, size):
+    '''Số mặt trên biên "bound" của block kích thước size = (Nj, Ni).'''
+    return size[0] if bound < 2 else size[1]
+
+
+def split_blocks(blocks, n, joints=joint_list, bocos=boco_list):
+    '''
+    Chia các blocks thành khoảng n blocks có số ô lưới gần bằng nhau (để cân bằng tải khi tính song song).
+    Số phần của mỗi block tỉ lệ với số ô lưới của nó, mỗi block được chia theo i, j bằng split_box.
+    Block "name" được thay bằng các block "name_0", "name_1"...; P, U được sao chép sang các block mới,
+    các mặt tiếp giáp giữa các block mới là joint, joints có thể là 'auto' (xem Blocks.find_joints). Sau khi chia cần ghi trường khí động (blocks.write_field())
+    và dùng joints, bocos mới:  blocks.run(joints=joints, bocos=bocos).
+    :return: joints, bocos - joint_list, boco_list cho các block mới
+    '''
+    if joints == 'auto': joints = blocks.find_joints()
+    sizes = [block.BCellS.size for block in blocks]
+    counts = [1]*blocks.len
+    for k in range(n - blocks.len):
+        b = max(range(blocks.len), key=lambda b: sizes[b][0]*sizes[b][1]/counts[b])
+        counts[b] += 1
+
+    # parts: [(block ban đầu, (j0, j1, i0, i1)), ...]
+    parts = []
+    for b, block in enumerate(blocks):
+        for box in split_box((0, sizes[b][0], 0, sizes[b][1]), counts[b], blocks.halo_width):
+            parts.append((b, box))
+
+    new_blocks, new_bocos = [], []
+    for k, (b, (j0, j1, i0, i1)) in enumerate(parts):
+        block = blocks[b]
+        new = Block('%s_%d' % (block.name, k), block.BNodes[j0:j1+1, i0:i1+1], blocks.halo_width)
+        new.BCellS.P[:] = block.BCellS.P[j0:j1, i0:i1]
+        new.BCellS.U[:] = block.BCellS.U[j0:j1, i0:i1]
+        new_blocks.append(new)
+        # điều kiện biên: các đoạn biên ban đầu nằm trong biên của block mới, biên bên trong block ban đầu là joint
+        bocos_n = []
+        for bound in range(4):
+            r = bound_range((j0, j1, i0, i1), bound, sizes[b])
+            if r is None:
+                bocos_n.append([(joint, None, None)])
+                continue
+            bocos_b = []
+            for boco in bocos[b][bound]:
+                s, e = slice(boco[1], boco[2]).indices(bound_len(bound, sizes[b]))[:2]
+                lo, hi = max(s, r[0]), min(e, r[1])
+                if lo < hi: bocos_b.append((boco[0], lo - r[0], hi - r[0]))
+            bocos_n.append(bocos_b)
+        new_bocos.append(bocos_n)
+
+    new_joints = []
+    # các joint ban đầu: mặt s1 + t của biên 1 nối với mặt s2 + t của biên 2
+    for b1, bound1, s1, e1, b2, bound2, s2, e2 in (joints or []):
+        s1, e1 = slice(s1, e1).indices(bound_len(bound1, sizes[b1]))[:2]
+        s2, e2 = slice(s2, e2).indices(bound_len(bound2, sizes[b2]))[:2]
+        for n1, (c1, box1) in enumerate(parts):
+            r1 = bound_range(box1, bound1, sizes[b1])
+            if c1 != b1 or r1 is None: continue
+            for n2, (c2, box2) in enumerate(parts):
+                r2 = bound_range(box2, bound2, sizes[b2])
+                if c2 != b2 or r2 is None: continue
+                t0 = max(max(s1, r1[0]) - s1, max(s2, r2[0]) - s2)
+                t1 = min(min(e1, r1[1]) - s1, min(e2, r2[1]) - s2)
+                if t0 < t1: new_joints.append((n1, bound1, s1 + t0 - r1[0], s1 + t1 - r1[0],
+                                               n2, bound2, s2 + t0 - r2[0], s2 + t1 - r2[0]))
+    # các mặt cắt: biên 1 (3) của block mới nối với biên 0 (2) của block mới bên cạnh
+    for n1, (b1, (j0, j1, i0, i1)) in enumerate(parts):
+        for n2, (b2, (J0, J1, I0, I1)) in enumerate(parts):
+            if b1 != b2: continue
+            if i1 == I0 and max(j0, J0) < min(j1, J1):
+                lo, hi = max(j0, J0), min(j1, J1)
+                new_joints.append((n1, 1, lo - j0, hi - j0, n2, 0, lo - J0, hi - J0))
+            if j1 == J0 and max(i0, I0) < min(i1, I1):
+                lo, hi = max(i0, I0), min(i1, I1)
+                new_joints.append((n1, 3, lo - i0, hi - i0, n2, 2, lo - I0, hi - I0))
+
+    cells = [new.BCellS.len for new in new_blocks]
+    print('split_blocks: %d blocks -> %d blocks, cells per block: %d - %d' % (blocks.len, len(parts), min(cells), max(cells)))
+    blocks.split_from = [(block.name, block.BNodes) for block in blocks]
+    blocks.split_parts = parts
+    blocks.blocks = new_blocks
+    blocks.len = len(new_blocks)
+    return new_joints, new_bocos
+
+
+def merge_blocks(blocks):
+    '''
+    Ghép trường khí động của các blocks đã chia bằng split_blocks về các blocks ban đầu
+    (ví dụ để export_block_data). Sau khi ghép có thể ghi trường khí động blocks.write_field().
+    '''
+    merged = [Block(name, nodes, blocks.halo_width) for name, nodes in blocks.split_from]
+    for new, (b, (j0, j1, i0, i1)) in zip(blocks, blocks.split_parts):
+        merged[b].BCellS.P[j0:j1, i0:i1] = new.BCellS.P
+        merged[b].BCellS.U[j0:j1, i0:i1] = new.BCellS.U
+    blocks.blocks = merged
+    blocks.len = len(merged)
+    del blocks.split_from, blocks.split_parts
+
+
+class BlocksPart(Blocks):
+    '''
+    Phần của Blocks gồm các blocks thuộc tiến trình thứ rank.
+
+    Parameters
+    ----------
+    blocks : Blocks - toàn bộ vùng tính toán
+    ids    : chỉ số các blocks thuộc tiến trình
+    rank   : số thứ tự tiến trình, tiến trình 0 ghi file trạng thái và hiển thị kết quả
+
+    Attributes
+    ----------
+    all_blocks: tất cả các blocks
+    blocks:     các blocks thuộc tiến trình
+    halo_map:   các phần tử của Blocks.halo_map có block nhận dữ liệu thuộc tiến trình
+    '''
+    def __init__(self, blocks, ids, rank):
+        self.__dict__.update(blocks.__dict__)
+        self.all_blocks = blocks.blocks
+        self.ids = ids
+        self.rank = rank
+        self.blocks = [blocks[n] for n in ids]
+        self.len = len(self.blocks)
+        self.halo_map = [m for m in blocks.halo_map if m[0] in ids]
+        self.pool = None
+        self.parallel_blocks = False
+
+    def exchange_halo(self):
+        '''Sao chép dữ liệu vào các lớp ô lưới ảo của các blocks thuộc tiến trình.'''
+        for dst_blk, dst_bound, dst_range, src_blk, src_bound, src_range, l in self.halo_map:
+            src = self.all_blocks[src_blk].BCellS
+            dst = self.all_blocks[dst_blk].BCellS
+            dst.ghost[dst_bound][l, dst_range] = src.layer(src_bound, l)[src_range]
+
+    # Các hàm reduce_*: mặc định chỉ có một tiến trình (value của chính nó),
+    # SharedBlocksPart, MPIBlocksPart thay bằng phép rút gọn trên tất cả các tiến trình.
+    def reduce_min(self, value):
+        '''Giá trị nhỏ nhất của value trên tất cả các tiến trình.'''
+        return value
+
+    def reduce_sum(self, value):
+        '''Tổng của value trên tất cả các tiến trình.'''
+        return value
+
+    def reduce_max(self, value):
+        '''Giá trị lớn nhất của value trên tất cả các tiến trình.'''
+        return value
+
+    def set_time_step(self, CFL, local=False):
+        '''Xác định bước thời gian trong toàn bộ vùng tính: min trên tất cả các tiến trình.'''
+        self.time_step_global = self.reduce_min(Blocks.set_time_step(self, CFL, local))
+        return self.time_step_global
+
+    def write_state(self, iter, time):
+        '''Chỉ tiến trình 0 ghi file trạng thái.'''
+        if self.rank == 0: Blocks.write_state(self, iter, time)
+
+    def write_residual(self, iter, time, L2, Linf, new=False):
+        '''Chỉ tiến trình 0 ghi file lịch sử hội tụ.'''
+        if self.rank == 0: Blocks.write_residual(self, iter, time, L2, Linf, new)
+
+
+class SharedBlocksPart(BlocksPart):
+    '''
+    Phần của Blocks trong một tiến trình của mp_solver: P, U, res của tất cả các blocks nằm trên
+    shared memory nên các lớp ô lưới ảo được sao chép trực tiếp từ blocks của tiến trình khác.
+
+    Mỗi bước (stage) Runge-Kutta có hai barrier trong residual:
+        - trước exchange_halo: mọi tiến trình đã cập nhật P ở bước trước;
+        - sau khi tính res: mọi tiến trình đã sao chép xong P vào các lớp ô lưới ảo,
+          trước khi P được cập nhật ở bước này;
+    bước đầu tiên của mỗi bước lặp có thêm một barrier trong set_time_step: mọi tiến trình đã ghi
+    bước thời gian của mình vào dt_all.
+    reduce_sum, reduce_max (khi tính chuẩn của res) có thêm hai barrier.
+    '''
+    def __init__(self, blocks, ids, rank, barrier, dt_all, sum_all):
+        BlocksPart.__init__(self, blocks, ids, rank)
+        self.barrier = barrier
+        self.dt_all = dt_all
+        self.sum_all = sum_all
+
+    def reduce_min(self, value):
+        # dt_all chỉ được ghi lại ở bước lặp sau, sau barrier trong residual,
+        # khi mọi tiến trình đã đọc xong giá trị min
+        self.dt_all[self.rank] = value
+        self.barrier.wait()
+        return min(self.dt_all)
+
+    def reduce_sum(self, value):
+        self.barrier.wait() # mọi tiến trình đã đọc xong sum_all của lần gọi trước
+        self.sum_all[self.rank] = value
+        self.barrier.wait()
+        return sum(self.sum_all)
+
+    def reduce_max(self, value):
+        self.barrier.wait() # dùng chung sum_all với reduce_sum
+        self.sum_all[self.rank] = value
+        self.barrier.wait()
+        return max(self.sum_all)
+
+    def residual(self, flux_func):
+        self.barrier.wait()
+        Blocks.residual(self, flux_func)
+        self.barrier.wait()
+
+
+def share_memory(blocks):
+    '''
+    Chuyển P, U, res của tất cả các blocks sang shared memory.
+    :return: list các SharedMemory (cần close, unlink sau khi dùng xong)
+    '''
+    from multiprocessing.shared_memory import SharedMemory # python >= 3.8, chỉ cần cho mp_solver
+    memories = []
+    for block in blocks:
+        shape = block.BCellS.P.shape
+        arrays = []
+        for k in range(3):
+            shm = SharedMemory(create=True, size=block.BCellS.P.nbytes)
+            memories.append(shm)
+            arrays.append(ndarray(shape, buffer=shm.buf))
+        block.set_arrays(*arrays)
+    return memories
+
+
+def mp_worker(blocks, ids, rank, barrier, dt_all, sum_all):
+    '''Tiến trình thứ rank: gọi eu_solver với phần Blocks của nó.'''
+    if rank > 0: sys.stdout = open(os.devnull, 'w') # chỉ tiến trình 0 hiển thị kết quả
+    try:
+        eu_solver(SharedBlocksPart(blocks, ids, rank, barrier, dt_all, sum_all))
+    except BaseException:
+        barrier.abort() # các tiến trình khác không phải chờ mãi ở barrier
+        raise
+
+
+def mp_solver(blocks, num_procs=None):
+    '''
+    Thay cho eu_solver: các blocks được chia cho num_procs tiến trình (mặc định - số CPU được phép dùng),
+    P, U, res nằm trên multiprocessing.shared_memory, bước thời gian chung là min trên các tiến trình.
+    Các tiến trình được tạo bằng fork (Linux), mỗi tiến trình ghi file .field của các blocks của nó.
+    Cần python >= 3.8 (multiprocessing.shared_memory), các hàm khác của lib.parallel dùng được với python 3.7.
+    Blocks.run(solver=mp_solver)
+    '''
+    if num_procs is None: # số CPU tiến trình được phép dùng (cpu_count có thể lớn hơn)
+        num_procs = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    num_procs = min(num_procs, blocks.len)
+    if num_procs < 2:
+        print('mp_solver: 1 process, running eu_solver')
+        return eu_solver(blocks)
+
+    # chọn hàm tính dòng một lần, trên toàn bộ vùng tính
+    set.flux_func = blocks.select_flux(set.flux_func)
+    groups = distribute_blocks(blocks, num_procs)
+    print('mp_solver: %d processes, blocks %s' % (num_procs, groups))
+
+    memories = share_memory(blocks)
+    ctx = get_context('fork')
+    barrier = ctx.Barrier(num_procs)
+    dt_all = ctx.Array('d', num_procs, lock=False)
+    sum_all = ctx.Array('d', num_procs, lock=False)
+    procs = [ctx.Process(target=mp_worker, args=(blocks, ids, rank, barrier, dt_all, sum_all))
+             for rank, ids in enumerate(groups)]
+    for proc in procs: proc.start()
+    for proc in procs: proc.join()
+
+    # trả P, U, res về bộ nhớ của tiến trình chính
+    for block in blocks:
+        cells = block.BCellS
+        block.set_arrays(cells.P.copy(), cells.U.copy(), cells.res.copy())
+    for shm in memories:
+        shm.close()
+        shm.unlink()
+    if any(proc.exitcode != 0 for proc in procs): raise RuntimeError('mp_solver: a worker process failed')
+
+
+class MPIBlocksPart(BlocksPart):
+    '''
+    Phần của Blocks trong một tiến trình MPI. Mỗi tiến trình đọc toàn bộ lưới nhưng chỉ tính
+    các blocks của nó; dữ liệu của các lớp ô lưới ảo trên joint giữa các blocks thuộc hai tiến trình
+    khác nhau được gửi bằng Isend/Irecv, bước thời gian chung là allreduce(MIN).
+
+    Attributes
+    ----------
+    comm:      MPI communicator
+    sends:     [(tag, src_blk, src_bound, src_range, l, dst_rank), ...] - dữ liệu gửi đi
+    recvs:     [(tag, dst_blk, dst_bound, dst_range, l, src_rank), ...] - dữ liệu nhận về
+    comm_time: tổng thời gian trao đổi dữ liệu (gồm cả thời gian chờ các tiến trình khác)
+    '''
+    def __init__(self, blocks, comm):
+        groups = distribute_blocks(blocks, comm.Get_size())
+        rank = comm.Get_rank()
+        BlocksPart.__init__(self, blocks, groups[rank], rank)
+        self.comm = comm
+        self.comm_time = 0.0
+
+        owner = {}
+        for r, ids in enumerate(groups):
+            for b in ids: owner[b] = r
+        # tag - chỉ số trong Blocks.halo_map, giống nhau trên tất cả các tiến trình
+        self.sends, self.recvs, self.halo_map = [], [], []
+        for tag, m in enumerate(blocks.halo_map):
+            dst_blk, dst_bound, dst_range, src_blk, src_bound, src_range, l = m
+            if owner[dst_blk] == rank and owner[src_blk] == rank: self.halo_map.append(m)
+            elif owner[dst_blk] == rank: self.recvs.append((tag, dst_blk, dst_bound, dst_range, l, owner[src_blk]))
+            elif owner[src_blk] == rank: self.sends.append((tag, src_blk, src_bound, src_range, l, owner[dst_blk]))
+
+    def exchange_halo(self):
+        '''Nhận, gửi dữ liệu của các joint giữa các tiến trình, sao chép dữ liệu của các joint trong tiến trình.'''
+        start_time = timer()
+        # các lớp ô lưới ảo ghost[bound][l, range] liên tục trong bộ nhớ: nhận trực tiếp vào đó
+        requests = [self.comm.Irecv(self.all_blocks[b].BCellS.ghost[bound][l, r], source=src, tag=tag)
+                    for tag, b, bound, r, l, src in self.recvs]
+        buffers = [ascontiguousarray(self.all_blocks[b].BCellS.layer(bound, l)[r])
+                   for tag, b, bound, r, l, dst in self.sends]
+        requests += [self.comm.Isend(buf, dest=send[5], tag=send[0]) for buf, send in zip(buffers, self.sends)]
+        BlocksPart.exchange_halo(self)
+        for request in requests: request.Wait()
+        self.comm_time += timer() - start_time
+
+    def reduce_min(self, value):
+        start_time = timer()
+        value = min(self.comm.allgather(value))
+        self.comm_time += timer() - start_time
+        return value
+
+    def reduce_sum(self, value):
+        start_time = timer()
+        value = sum(self.comm.allgather(value))
+        self.comm_time += timer() - start_time
+        return value
+
+    def reduce_max(self, value):
+        start_time = timer()
+        value = max(self.comm.allgather(value))
+        self.comm_time += timer() - start_time
+        return value
+
+    def select_flux(self, flux_func):
+        '''Mọi tiến trình dùng hàm tính dòng được chọn ở tiến trình 0.'''
+        flux_func = Blocks.select_flux(self, flux_func)
+        names = [name for name in flux_registry if flux_registry[name] is flux_func]
+        name = self.comm.bcast(names[0] if names else None, root=0)
+        return flux_registry[name] if name is not None else flux_func
+
+
+def mpi_solver(blocks, comm=None):
+    '''
+    Thay cho eu_solver khi chạy bằng MPI:  mpirun -np N python run.py  với blocks.run(solver=mpi_solver).
+    Các blocks được chia cho N tiến trình, mỗi tiến trình ghi file .field của các blocks của nó,
+    tiến trình 0 ghi file trạng thái và hiển thị thời gian tính toán, trao đổi dữ liệu của mỗi tiến trình.
+    Cuối cùng P, U của tất cả các blocks được gửi về tiến trình 0, blocks.rank = số thứ tự tiến trình:
+    export_block_data, plot_field chỉ được thực hiện ở tiến trình 0.
+    Trường khí động ban đầu (init_field) cần được thiết lập trước, bằng một tiến trình.
+    :param comm: MPI communicator, mặc định MPI.COMM_WORLD
+    '''
+    if comm is None:
+        from mpi4py import MPI # chỉ import (MPI_Init) khi dùng mpi_solver
+        comm = MPI.COMM_WORLD
+    if comm.Get_size() < 2: return eu_solver(blocks)
+
+    part = MPIBlocksPart(blocks, comm)
+    stdout = sys.stdout
+    if part.rank > 0: sys.stdout = open(os.devnull, 'w') # chỉ tiến trình 0 hiển thị kết quả
+    start_time = timer()
+    try:
+        eu_solver(part)
+    except BaseException:
+        traceback.print_exc()
+        comm.Abort(1) # các tiến trình khác không phải chờ mãi
+    finally:
+        if part.rank > 0:
+            sys.stdout.close()
+            sys.stdout = stdout
+    total_time = timer() - start_time
+
+    # gửi trường khí động về tiến trình 0
+    blocks.rank = part.rank
+    fields = comm.gather([(b, blocks[b].BCellS.P, blocks[b].BCellS.U) for b in part.ids], root=0)
+    if part.rank == 0:
+        for b, P, U in (item for items in fields for item in items):
+            blocks[b].BCellS.P[:] = P
+            blocks[b].BCellS.U[:] = U
+
+    times = comm.gather((part.ids, total_time - part.comm_time, part.comm_time), root=0)
+    if part.rank == 0:
+        print('\nmpi_solver: %d processes' % comm.Get_size())
+        for rank, (ids, compute_time, comm_time) in enumerate(times):
+            print('rank %d, blocks %s: compute %f s, communication %f s' % (rank, ids, compute_time, comm_time))
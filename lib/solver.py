@@ -4,13 +4,52 @@
 import setting as set
 # import example_setting_outflow as set
 
+# Các phương pháp Runge-Kutta ít bộ nhớ (chỉ cần lưu thêm U0 ở đầu bước lặp), mỗi bước (stage):
+#   U = alpha*U0 + (1 - alpha)*U + beta*dt/volume*res(U)
+# rk_schemes: tên -> [(alpha, beta), ...]
+#   euler    - Euler hiện (một bước)
+#   ssp_rk3  - SSP-RK3 (Shu-Osher), bậc 3, cho bài toán không dừng
+#   jameson4, jameson5 - Jameson nhiều bước, hệ số tối ưu cho sơ đồ upwind bậc một (Blazek),
+#                        cho bài toán dừng, cho phép CFL khoảng 2.0 và 2.5
+rk_schemes = {'euler': [(0.0, 1.0)],
+              'ssp_rk3': [(0.0, 1.0), (3/4, 1/4), (1/3, 2/3)],
+              'jameson4': [(1.0, 0.0833), (1.0, 0.2069), (1.0, 0.4265), (1.0, 1.0)],
+              'jameson5': [(1.0, 0.0533), (1.0, 0.1263), (1.0, 0.2375), (1.0, 0.4414), (1.0, 1.0)]}
+
+# Số CFL thay đổi theo chuẩn của res (switched evolution relaxation - SER) cho bài toán dừng
+class SER:
+    '''
+    CFL = CFL0*res0/res, giới hạn trong [CFL_min, limit], limit <= CFL_max.
+    Khi res tăng hơn rise lần so với bước lặp trước (hoặc khi gọi back_off), limit giảm còn cut*CFL,
+    sau mỗi bước lặp limit tăng growth lần cho tới CFL_max.
+    '''
+    def __init__(self, CFL0, CFL_min, CFL_max, cut=0.5, growth=1.1, rise=1.2):
+        self.CFL0, self.CFL_min, self.CFL_max = CFL0, CFL_min, CFL_max
+        self.cut, self.growth, self.rise = cut, growth, rise
+        self.res0 = self.res = None
+        self.limit = CFL_max
+        self.CFL = CFL0
+
+    def __call__(self, res):
+        '''Số CFL cho bước lặp có chuẩn của res bằng res.'''
+        if self.res0 is None: self.res0 = res if res > 0 else 1.0
+        if self.res is not None and res > self.rise*self.res: self.back_off()
+        self.res = res
+        CFL = min(self.limit, self.CFL0*self.res0/res) if res > 0 else self.limit
+        self.CFL = max(self.CFL_min, CFL)
+        self.limit = min(self.CFL_max, self.growth*self.limit)
+        return self.CFL
+
+    def back_off(self):
+        '''Giảm giới hạn trên của CFL (res tăng, bước lặp không thành công).'''
+        self.limit = max(self.CFL_min, self.cut*self.CFL)
+
+
 # Hàm eu_solver thực hiện các bước lặp để tìm nghiệm
 # Biến đầu vào gồm có: các ô lưới, các mặt, số vòng lặp, thời gian lúc ban đầu
 def eu_solver(blocks):
     # đọc iter và time từ file status
-    with open(blocks.state_file, 'r') as f: line = f.readlines()[1].split()
-    iter = int(line[0])
-    time = float(line[1])
+    iter, time = blocks.read_state()
 
     # tính theo thời gian
     if set.time_target is None: set.time_target = 1.e10
@@ -18,15 +57,131 @@ def eu_solver(blocks):
     if set.write_field_frequency_time is None: set.write_field_frequency_time = 1.e10
     if set.write_field_frequency_iter is None: set.write_field_frequency_iter = 1e10
     if set.print_frequency_iter is None: set.display_iter = 1
+
+    # số luồng tính song song (không bắt buộc trong setting.py)
+    blocks.set_threads(getattr(set, 'num_threads', 1))
+
+    # bước thời gian cục bộ cho bài toán dừng (không bắt buộc trong setting.py)
+    local = getattr(set, 'local_time_step', False)
+
+    # hệ số làm trơn ẩn res, ví dụ 0.5 - 1.0 (không bắt buộc trong setting.py)
+    blocks.set_smoothing(getattr(set, 'residual_smoothing', 0.0))
+
+    # phương pháp tích phân theo thời gian: tên trong rk_schemes hoặc 'lusgs' - phương pháp ẩn LU-SGS
+    # (không bắt buộc trong setting.py)
+    scheme = getattr(set, 'time_scheme', 'euler')
+    implicit = scheme == 'lusgs'
+    stages = rk_schemes['euler' if implicit else scheme]
+    omega = getattr(set, 'lusgs_omega', 1.0)
+    res0 = None
+
+    # số CFL thay đổi theo res (SER, bài toán dừng): CFL tăng khi res giảm, tới CFL_max, giảm khi res tăng;
+    # CFL_max = None - CFL không đổi, CFL_min mặc định 0.1*CFL (không bắt buộc trong setting.py).
+    # Với các phương pháp hiện CFL_max bị giới hạn bởi điều kiện ổn định, ví dụ 'jameson5' với residual_smoothing.
+    CFL_max = getattr(set, 'CFL_max', None)
+    ser = SER(set.CFL, getattr(set, 'CFL_min', 0.1*set.CFL), CFL_max) if CFL_max else None
+    CFL = set.CFL
+
+    # multigrid FAS cho bài toán dừng: số lưới (tính cả lưới ban đầu), 'V' hoặc 'W', hệ số làm trơn hiệu chỉnh
+    # (không bắt buộc trong setting.py, xem lib.multigrid)
+    levels = getattr(set, 'multigrid_levels', 1)
+    if levels > 1 and hasattr(blocks, 'all_blocks'): # phần Blocks của một tiến trình (mp_solver, mpi_solver)
+        print('multigrid is not supported by mp_solver, mpi_solver: multigrid_levels = %d ignored' % levels)
+        levels = 1
+    if levels > 1:
+        from .multigrid import Multigrid
+        multigrid = Multigrid(blocks, levels, getattr(set, 'multigrid_cycle', 'V'), getattr(set, 'multigrid_smoothing', 0.0))
+
+    # chỉ tính trong các vùng lời giải còn thay đổi (bài toán dừng, phương pháp hiện): mỗi activity_sweep_iter
+    # bước lặp (và khi ghi lịch sử hội tụ) res được tính trên toàn bộ vùng tính, sau đó chỉ tính tiếp trong các tile
+    # activity_tile x activity_tile ô lưới có max |res/volume| lớn hơn activity_tol*max |res/volume| trên toàn
+    # vùng tính (ví dụ 1e-4) và trong các tile bên cạnh chúng. Vùng hoạt động chỉ mở rộng được một tile sau mỗi lần
+    # tính trên toàn bộ vùng tính. activity_tol = None - tính mọi ô lưới; không dùng với 'lusgs' và multigrid
+    # (không bắt buộc trong setting.py, xem Cells.set_active)
+    activity_tol = getattr(set, 'activity_tol', None) if not implicit and levels == 1 else None
+    tile = getattr(set, 'activity_tile', 16)
+    sweep_iter = getattr(set, 'activity_sweep_iter', 3)
+    active = 1.0
+
+    # kiểm tra rho > 0, p > 0 sau mỗi bước lặp; U được lưu trong bộ nhớ mỗi snapshot_frequency_iter bước lặp.
+    # Khi có ô lưới không hợp lệ: quay lại U, iter, time đã lưu, số CFL không vượt quá một nửa CFL lúc đó;
+    # sau max_rollbacks lần quay lại thì dừng tính (không bắt buộc trong setting.py)
+    guard = getattr(set, 'divergence_check', True)
+    snapshot_iter = getattr(set, 'snapshot_frequency_iter', 100)
+    max_rollbacks = getattr(set, 'max_rollbacks', 5)
+    snapshot = (iter, time, blocks.get_U()) if guard else None
+    rollbacks, CFL_limit = 0, None
+
+    # chuẩn L2, Linf của res theo 4 phương trình mỗi residual_frequency_iter bước lặp (mặc định print_frequency_iter),
+    # ghi vào Blocks.residual_file; dừng tính khi L2 của cả 4 phương trình giảm convergence_orders bậc
+    # so với bước lặp đầu tiên của lần chạy này, None - không dừng (không bắt buộc trong setting.py)
+    monitor_iter = getattr(set, 'residual_frequency_iter', set.print_frequency_iter)
+    orders = getattr(set, 'convergence_orders', None)
+    L2_0, new_file = None, iter == 0
+
+    # hàm tính dòng: hàm, tên trong fluxes.flux_registry hoặc 'auto'
+    flux_func = blocks.select_flux(set.flux_func)
     while(time < set.time_target and iter < set.iter_target):
         iter += 1
-        # tính bước thời gian
-        dt = blocks.set_time_step(set.CFL)  # có thể thiết lập dt trong set: dt = set.dt
-        if (time + dt > set.time_target): dt = set.time_target - time
-        time += dt
+        display = not(iter % set.print_frequency_iter)
+        monitor = not(iter % monitor_iter)
+        sweep = activity_tol is not None and (monitor or not iter % sweep_iter)
+        if sweep: blocks.set_active(None)
+        if len(stages) > 1: blocks.save_U()
+        for stage, (alpha, beta) in enumerate(stages):
+            # tính dòng trước, để bước thời gian dùng lại vận tốc sóng trên các mặt (nếu có)
+            blocks.residual(flux_func)
+
+            # tính bước thời gian ở bước (stage) đầu tiên, dùng cho tất cả các bước
+            if stage == 0:
+                # chuẩn của res so với bước lặp đầu tiên
+                if res0 is None or display or ser:
+                    res = blocks.residual_norm()
+                    if res0 is None: res0 = res if res > 0 else 1.0
+                if L2_0 is None or monitor:
+                    L2, Linf = blocks.residual_norms()
+                    if L2_0 is None: L2_0 = L2 + (L2 == 0)
+                if sweep: active = blocks.set_active(activity_tol, tile)
+                if ser: CFL = ser(res)
+                if CFL_limit is not None: CFL = min(CFL, CFL_limit)
+
+                dt = blocks.set_time_step(CFL, local)  # có thể thiết lập dt trong set: dt = set.dt
+                if (time + dt > set.time_target): dt = set.time_target - time
+                time += dt
+
+            # cập nhật U, P; với bước thời gian cục bộ, time chỉ là tổng các bước thời gian nhỏ nhất
+            step = None if local else dt
+            if implicit: blocks.update_lusgs(step, omega)
+            else: blocks.update(step, alpha, beta)
+
+        # hiệu chỉnh trên các lưới thô
+        if levels > 1: multigrid.cycle(flux_func, CFL, local, stages)
 
-        blocks.iteration(set.flux_func) # gọi bước lặp
-        if not(iter % set.print_frequency_iter): print('iteration: %d, dt: %f, time: %f' % (iter, dt, time))
+        # kiểm tra trạng thái vật lý, quay lại U đã lưu nếu cần
+        if guard:
+            if blocks.check():
+                rollbacks += 1
+                print('divergence at iteration: %d, CFL: %.3f, rollback to iteration: %d' % (iter, CFL, snapshot[0]))
+                iter, time = snapshot[:2]
+                blocks.set_U(snapshot[2])
+                if rollbacks > max_rollbacks:
+                    print('divergence: stop after %d rollbacks' % max_rollbacks)
+                    break
+                CFL_limit = 0.5*CFL
+                if ser: ser.back_off()
+                continue
+            if not iter % snapshot_iter: snapshot = (iter, time, blocks.get_U())
+
+        # lịch sử hội tụ, dừng tính khi đã hội tụ
+        if monitor:
+            blocks.write_residual(iter, time, L2, Linf, new_file)
+            new_file = False
+            if orders is not None and (L2/L2_0).max() <= 10.0**-orders:
+                print('converged at iteration: %d, L2/L2_0: %s' % (iter, ' '.join('%.3e' % r for r in L2/L2_0)))
+                break
+        if display:
+            print('iteration: %d, dt: %f, time: %f, res: %.3e, res/res0: %.3e' % (iter, dt, time, res, res/res0) +
+                  (', CFL: %.3f' % CFL if ser else '') + (', active: %.3f' % active if activity_tol else ''))
 
         # ghi lại kết quả giữa chừng
         period = 1
@@ -35,8 +190,108 @@ def eu_solver(blocks):
             print('\nwrite_field at iteration: %d, time: %f\n' % (iter, time))
             blocks.write_field()
 
+    blocks.set_threads(1)
+
     # ghi lại kết quả cuối cùng
     blocks.write_field()
-    with open(blocks.state_file, 'w') as f: f.write('iter time:\n%d %f' % (iter, time))
+    blocks.write_state(iter, time)
+
+
+
 
+# Hàm newton_solver giải bài toán dừng res(U) = 0 bằng phương pháp Newton-Krylov không cần ma trận Jacobi (JFNK),
+# dùng thay cho eu_solver: blocks.run(solver=newton_solver). Mỗi bước lặp Newton (pseudo-transient continuation):
+#   (V/dt - dres/dU) dU = res,  U = U + dU
+# được giải gần đúng bằng GMRES (scipy.sparse.linalg), tích Jacobi với vector được tính bằng sai phân:
+#   dres/dU v = (res(U + eps*v) - res(U))/eps
+# tiền điều kiện - LU-SGS hoặc đường chéo D trong từng block (Blocks.precondition).
+# Số CFL tăng theo mức giảm của res (SER): CFL = set.CFL*res0/res, không quá newton_CFL_max,
+# khi CFL lớn phương pháp tiến tới phương pháp Newton, res giảm rất nhanh ở các bước lặp cuối.
+# Nếu res tăng, GMRES không giảm được sai số (hệ gần suy biến) hoặc bước dU phải giảm để rho, p dương,
+# giới hạn CFL giảm 10 lần, sau đó tăng lại 2 lần sau mỗi bước lặp.
+# Các tham số không bắt buộc trong setting.py:
+#   newton_CFL_max        - số CFL lớn nhất, mặc định 1e5
+#   newton_preconditioner - 'lusgs' (mặc định) hoặc 'jacobi'
+#   gmres_tol, gmres_restart - sai số tương đối và số bước lặp GMRES trong mỗi bước lặp Newton, mặc định 1e-2, 30
+#   local_time_step       - mặc định True (khác với eu_solver): bước thời gian cục bộ cho số hạng V/dt
+# Vector U của toàn bộ vùng tính được lưu trong một tiến trình (không dùng với mp_solver, mpi_solver),
+# có thể tính song song bằng các luồng (num_threads).
+def newton_solver(blocks):
+    from numpy import tile, isfinite
+    from numpy.linalg import norm
+    from scipy.sparse.linalg import gmres, LinearOperator
+    from inspect import signature
+    # scipy < 1.12 (python 3.7): sai số tương đối của gmres là tham số tol thay cho rtol
+    tol_name = 'rtol' if 'rtol' in signature(gmres).parameters else 'tol'
 
+    iter, time = blocks.read_state()
+    if set.iter_target is None: set.iter_target = 1e10
+    if set.write_field_frequency_iter is None: set.write_field_frequency_iter = 1e10
+    if set.print_frequency_iter is None: set.print_frequency_iter = 1
+
+    blocks.set_threads(getattr(set, 'num_threads', 1))
+    local = getattr(set, 'local_time_step', True)
+    CFL_max = getattr(set, 'newton_CFL_max', 1e5)
+    method = getattr(set, 'newton_preconditioner', 'lusgs')
+    omega = getattr(set, 'lusgs_omega', 1.0)
+    tol, restart = getattr(set, 'gmres_tol', 1e-2), getattr(set, 'gmres_restart', 30)
+
+    flux_func = blocks.select_flux(set.flux_func)
+    U = blocks.get_U()
+    R = blocks.residual_vector(flux_func)
+    ser = SER(set.CFL, 0.0, CFL_max, cut=0.1, growth=2.0, rise=1.0)
+    while iter < set.iter_target:
+        iter += 1
+        res = blocks.residual_norm()
+        CFL = ser(res)
+        blocks.set_time_step(CFL, local)
+        diag = blocks.time_step_vector()
+
+        # đơn vị của các biến: rho, rho*a, rho*a, rho*a^2 (trung bình trên toàn vùng tính)
+        rms = (U.reshape(-1, 4)**2).mean(axis=0)**0.5
+        s = tile([rms[0], (rms[0]*rms[3])**0.5, (rms[0]*rms[3])**0.5, rms[3]], len(U)//4)
+        size = 1e-7*(1.0 + norm(U/s))
+
+        def matvec(y):
+            eps = size/max(norm(y), 1e-300)
+            blocks.set_U(U + eps*s*y)
+            Rv = blocks.residual_vector(flux_func)
+            blocks.set_U(U)
+            return diag*y - (Rv - R)/(eps*s)
+
+        def psolve(y):
+            # LU-SGS dùng dòng F(U + dU) - F(U): vế phải được thu nhỏ để phép tính gần như tuyến tính
+            k = size/max(norm(y), 1e-300)
+            return blocks.precondition(k*s*y, method, omega)/(k*s)
+
+        n = len(U)
+        count, error = [0], [1.0]
+        def callback(r):
+            count[0] += 1
+            error[0] = r
+        y = gmres(LinearOperator((n, n), matvec), R/s, atol=0.0, restart=restart, maxiter=1,
+                  M=LinearOperator((n, n), psolve), callback=callback, callback_type='pr_norm', **{tol_name: tol})[0]
+
+        # giảm bước dU nếu rho, p không dương
+        dU = s*y
+        for k in range(10):
+            blocks.set_U(U + dU)
+            if all(blocks.map_blocks(lambda block: (block.BCellS.P[..., [0, 3]] > 0).all())): break
+            dU *= 0.5
+        else:
+            dU[:] = 0.0
+            blocks.set_U(U)
+        U = U + dU
+        if error[0] > 0.5 or k > 0: ser.back_off()
+        R = blocks.residual_vector(flux_func)
+        if not isfinite(R).all(): raise ValueError('newton_solver: res is not finite at iteration %d' % iter)
+
+        if not(iter % set.print_frequency_iter):
+            print('iteration: %d, CFL: %.3e, gmres: %d, res: %.3e, res/res0: %.3e' % (iter, CFL, count[0], res, res/ser.res0))
+        if not(iter % set.write_field_frequency_iter):
+            print('\nwrite_field at iteration: %d\n' % iter)
+            blocks.write_field()
+
+    blocks.set_threads(1)
+    blocks.write_field()
+    blocks.write_state(iter, time)
@@ -2,12 +2,21 @@
 # Copyright (C) 2019  Nguyen Ngoc Sang, <https://github.com/SangVn>
 
 from lib.data import Blocks
+# from lib.parallel import mp_solver # nhiều tiến trình: blocks.run(solver=mp_solver)
+# from lib.parallel import mpi_solver # MPI: mpirun -np N python run.py, blocks.run(solver=mpi_solver)
+# from lib.parallel import split_blocks, merge_blocks # chia các blocks để cân bằng tải
+# from lib.solver import newton_solver # bài toán dừng, JFNK (cần scipy): blocks.run(solver=newton_solver)
 # from setting import P_left, P_right # test1D
 
 def run():
     blocks = Blocks()
     # blocks.init_field_test1D(P_left, P_right) # test1D
+    # thay cho init_field (bỏ dòng init_field): khởi tạo từ kết quả trên lưới khác cùng hình học (cần scipy),
+    # file lưới và các file .field của kết quả đó được chép vào thư mục khác path_dir, ví dụ:
+    # blocks.init_field_interpolate('examples/nozzle/coarse/cdnozzle.mesh', field_dir='examples/nozzle/coarse/')
     blocks.init_field()
+    # joints, bocos = split_blocks(blocks, 4); blocks.write_field() # chia thành 4 blocks
+    # blocks.run(solver=mp_solver, joints=joints, bocos=bocos); merge_blocks(blocks)
     blocks.run()
     blocks.export_block_data('field_bd.dat')
     blocks.plot_field(field='p', pfunc='pcolor')